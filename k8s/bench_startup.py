@@ -0,0 +1,135 @@
+"""
+Startup benchmark of main.py based on `python -X importtime`.
+
+    python bench_startup.py [--budget 50] [--stage-budget 1000] [--runs 5]
+
+Checks that `main.py --help` imports within `--budget` ms and pulls in none
+of the heavy dependencies, and that every stage of main.STAGE_MODULES
+imports within `--stage-budget` ms and only the dependencies it needs.
+Exits non-zero when a budget is exceeded, so it can run in CI or a loop.
+"""
+import sys
+import argparse
+import subprocess
+
+import main
+
+HEAVY = ('kubernetes', 'ecdsa', 'sha3', 'toml', 'requests', 'yaml')
+
+# heavy modules a stage may import, everything else in HEAVY is a regression
+# unless it only comes in as a dependency of an allowed one (see pulled_in)
+ALLOWED = {
+    'network': ('kubernetes', 'yaml'),
+    'planner': ('yaml',),
+    'load': ('requests', 'ecdsa', 'sha3'),
+    'logs': ('kubernetes', 'yaml'),
+    'monitor': ('kubernetes', 'yaml', 'requests', 'ecdsa', 'sha3'),
+    'snapshot': ('kubernetes', 'yaml'),
+}
+
+
+def import_times(args):
+    """
+    Run python -X importtime with `args`, return ({top level module: us},
+    {every imported module: the module importing it, None at top level}).
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime'] + args,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    top, parents = {}, {}
+    # modules are listed after everything they import, indented one level
+    # deeper, so children wait here until their importer's line comes
+    waiting = {}
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or line.endswith('imported package'):
+            continue
+        _, cumulative, name = line.split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        parents[name] = None
+        for child in waiting.pop(depth + 1, []):
+            parents[child] = name
+        waiting.setdefault(depth, []).append(name)
+        if depth == 0:
+            top[name] = int(cumulative)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    return top, parents
+
+
+def measure(args, runs):
+    """ best of `runs` total import time in ms, and the imported modules """
+    best, parents = None, {}
+    for _ in range(runs):
+        top, parents = import_times(args)
+        total = sum(top.values()) / 1000
+        best = total if best is None else min(best, total)
+    return best, parents
+
+
+def heavy(seen):
+    return sorted({name.split('.')[0] for name in seen} & set(HEAVY))
+
+
+def pulled_in(parents):
+    """
+    Heavy packages imported by our code (or the stdlib on its behalf), not
+    only as a dependency of another heavy package: kubernetes brings
+    requests and yaml along, a stage allowed kubernetes pays for them anyway.
+    """
+    direct = set()
+    for name in parents:
+        package = name.split('.')[0]
+        if package not in HEAVY:
+            continue
+        importer = parents[name]
+        while importer is not None:
+            if importer.split('.')[0] in HEAVY and importer.split('.')[0] != package:
+                break
+            importer = parents[importer]
+        else:
+            direct.add(package)
+    return sorted(direct)
+
+
+def main_():
+    parser = argparse.ArgumentParser(description='main.py startup benchmark')
+    parser.add_argument('--budget', type=float, default=50, help='ms for main.py --help')
+    parser.add_argument('--stage-budget', type=float, default=1000, help='ms for the imports of one stage')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    # a first run compiles the .pyc files, it should not count
+    import_times(['main.py', '--help'])
+
+    failures = []
+    ms, seen = measure(['main.py', '--help'], args.runs)
+    print('{:<12} {:>9}  {}'.format('stage', 'ms', 'heavy imports'))
+    print('{:<12} {:>9.1f}  {}'.format('--help', ms, ', '.join(heavy(seen)) or '-'))
+    if ms > args.budget:
+        failures.append('--help imports in {:.1f}ms, budget {}ms'.format(ms, args.budget))
+    if heavy(seen):
+        failures.append('--help imports {}'.format(', '.join(heavy(seen))))
+
+    for stage, modules in main.STAGE_MODULES.items():
+        code = 'import main; ' + '; '.join('import {}'.format(m) for m in modules)
+        try:
+            ms, seen = measure(['-c', code], args.runs)
+        except RuntimeError as e:
+            failures.append('{}: {}'.format(stage, e))
+            continue
+        allowed = {name for m in modules for name in ALLOWED[m]}
+        print('{:<12} {:>9.1f}  {}'.format(stage, ms, ', '.join(heavy(seen)) or '-'))
+        if ms > args.stage_budget:
+            failures.append('{} imports in {:.1f}ms, budget {}ms'.format(stage, ms, args.stage_budget))
+        extra = [name for name in pulled_in(seen) if name not in allowed]
+        if extra:
+            failures.append('{} imports {}'.format(stage, ', '.join(extra)))
+
+    for failure in failures:
+        print('FAIL', failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_())
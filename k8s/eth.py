@@ -16,6 +16,42 @@ def checksum_encode(addr_str): # Takes a hex (string) address as input
             out += c
     return '0x' + out
 
+def keccak256(data):
+    keccak = sha3.keccak_256()
+    keccak.update(data)
+    return keccak.digest()
+
+
+def _encode_word(typ, value):
+    if typ == 'bool':
+        value = int(bool(value))
+    elif typ == 'address':
+        value = int(value, 16)
+    return int(value).to_bytes(32, 'big')
+
+
+def encode_call(signature, *args):
+    """
+    ABI encode a contract call, e.g. encode_call('getBalance(string)', 'a').
+
+    Supports the static types used by the pier example contracts (uintN,
+    bool, address) and dynamic `string`s. Returns the 0x prefixed call data.
+    """
+    types = signature[signature.index('(') + 1:-1].split(',') if not signature.endswith('()') else []
+    head, tail = b'', b''
+    offset = 32 * len(types)
+    for typ, value in zip(types, args):
+        if typ == 'string':
+            data = value.encode()
+            padded = data + b'\0' * (-len(data) % 32)
+            head += offset.to_bytes(32, 'big')
+            tail += len(data).to_bytes(32, 'big') + padded
+            offset += 32 + len(padded)
+        else:
+            head += _encode_word(typ, value)
+    return '0x' + (keccak256(signature.encode())[:4] + head + tail).hex()
+
+
 def create_eth_address():
     keccak = sha3.keccak_256()
 
@@ -30,12 +66,63 @@ def create_eth_address():
             'address': checksum_encode(address)}
 
 
-def get_genesis_content(accounts):
+# Block production and node tuning of an appchain geth. `dev` is the
+# original `geth --dev` setup (instant seal), every other profile runs a
+# single-signer clique chain sealing a block every `period` seconds.
+GETH_PROFILES = {
+    'dev': {'dev': True},
+    'balanced': {
+        'period': 2,
+        'gasLimit': 30000000,
+        'cache': 1024,
+        'txpool': {'globalslots': 8192, 'accountslots': 256, 'globalqueue': 2048, 'accountqueue': 128},
+        'rpc': {'rpc.gascap': 50000000},
+    },
+    'throughput': {
+        'period': 1,
+        'gasLimit': 100000000,
+        'cache': 4096,
+        'txpool': {'globalslots': 32768, 'accountslots': 4096, 'globalqueue': 8192, 'accountqueue': 1024},
+        'rpc': {'rpc.gascap': 100000000},
+    },
+}
+
+# what a clique profile leaves out is taken from here
+CLIQUE_DEFAULTS = GETH_PROFILES['balanced']
+
+
+def merge_profile(base, override):
+    """
+    `override` (a `geth_profiles` entry of config.json) on top of `base`,
+    the txpool and rpc settings merged key by key.
+    """
+    profile = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(profile.get(key), dict):
+            profile[key] = dict(profile[key], **value)
+        else:
+            profile[key] = value
+    return profile
+
+
+# the account of goduck's quick_start/account.key, which deploys and
+# audits the broker/transfer contracts and so needs ether on clique chains
+GODUCK_ACCOUNT = '0x20F7Fac801C5Fc3f7E20cFbADaA1CDb33d818Fa3'
+
+# where the genesis, signer key and password are mounted in geth pods
+GENESIS_DIR = '/root/genesis'
+# kept apart from the image's own --dev datadir
+GETH_DATADIR = '/root/appchain'
+GETH_RPCAPI = 'eth,web3,personal,net,miner,admin,debug,txpool'
+
+
+def get_genesis_content(accounts, profile=None, funded=()):
     """
     Create genesis json for geth.
 
     Accounts will be funded with 1 million ether.
-    Accounts[0] is the coinbase/etherbase
+    Accounts[0] is the coinbase/etherbase, with a clique `profile` it is
+    also the only signer and funded like the other accounts and `funded`.
     """
     # 1 Million ether
     initial_balance = '0xD3C21BCECCEDA1000000'
@@ -57,8 +144,49 @@ def get_genesis_content(accounts):
         }
     }
 
+    if profile and not profile.get('dev'):
+        del data['config']['ethash']
+        data['config']['clique'] = {'period': profile.get('period', CLIQUE_DEFAULTS['period']), 'epoch': 30000}
+        data['gasLimit'] = str(profile.get('gasLimit', CLIQUE_DEFAULTS['gasLimit']))
+        # vanity, signer list, empty seal
+        signer = accounts[0]['address'].lower().replace('0x', '')
+        data['extraData'] = '0x' + '00' * 32 + signer + '00' * 65
+        data['alloc'][accounts[0]['address']] = {'balance': initial_balance}
+        for address in funded:
+            data['alloc'][address] = {'balance': initial_balance}
+
     # add remaining accounts to alloc
     for account in accounts[1:]:
         data['alloc'][account['address']] = {'balance': initial_balance}
 
     return json.dumps(data)
+
+
+def geth_command(profile, signer):
+    """
+    Shell command of a geth container running `profile`, sealing with the
+    `signer` address whose key is mounted in GENESIS_DIR.
+    """
+    if profile.get('dev'):
+        return None
+    gas_limit = profile.get('gasLimit', CLIQUE_DEFAULTS['gasLimit'])
+    flags = [
+        '--datadir', GETH_DATADIR, '--networkid', '15', '--nodiscover', '--maxpeers', '0', '--nousb',
+        '--mine', '--miner.threads', '1', '--miner.etherbase', signer,
+        '--miner.gaslimit', gas_limit, '--miner.gastarget', gas_limit,
+        '--unlock', signer, '--password', '{}/password'.format(GENESIS_DIR), '--allow-insecure-unlock',
+        '--cache', profile.get('cache', CLIQUE_DEFAULTS['cache']),
+        '--rpc', '--rpcaddr', '0.0.0.0', '--rpcport', '8545', '--rpcapi', GETH_RPCAPI,
+        '--rpccorsdomain', 'https://remix.ethereum.org',
+        '--ws', '--wsaddr', '0.0.0.0', '--wsport', '8546', '--wsapi', GETH_RPCAPI,
+    ]
+    if profile.get('gcmode'):
+        flags += ['--gcmode', profile['gcmode']]
+    for key, value in profile.get('txpool', {}).items():
+        flags += ['--txpool.{}'.format(key), value]
+    for key, value in profile.get('rpc', {}).items():
+        flags += ['--{}'.format(key), value]
+    # `account import` fails harmlessly when the datadir already has the key
+    return ('geth --datadir {0} init {1}/genesis.json && '
+            '(geth --datadir {0} account import --password {1}/password {1}/signer.key || true) && '
+            'exec geth {2}').format(GETH_DATADIR, GENESIS_DIR, ' '.join(str(f) for f in flags))
@@ -0,0 +1,409 @@
+import io
+import os
+import time
+import random
+import yaml
+import base64
+import logging
+import tarfile
+import threading
+
+from kubernetes import client, config
+from kubernetes.stream import stream
+from kubernetes.client.rest import ApiException
+from kubernetes.stream.ws_client import ERROR_CHANNEL
+
+logger = logging.getLogger()
+
+_config_lock = threading.Lock()
+_config_loaded = False
+
+# stdin is written in pieces so a single websocket frame stays small
+STDIN_CHUNK = 1 << 16
+
+
+def load_config():
+    """
+    Load ~/.kube/config once, on the first api call rather than at import.
+    """
+    global _config_loaded
+    with _config_lock:
+        if not _config_loaded:
+            config.load_kube_config()
+            _config_loaded = True
+
+
+class TokenBucket:
+    """
+    Client side rate limit shared by every api call of the process.
+
+    The rate backs off (halves) whenever the API server throttles us and
+    creeps back up to `qps` with every successful call, so bulk runs settle
+    at the highest rate the server accepts.
+    """
+    def __init__(self, qps, burst):
+        self.lock = threading.Lock()
+        self.configure(qps, burst)
+
+    def configure(self, qps, burst):
+        with self.lock:
+            self.qps = float(qps)
+            self.rate = float(qps)
+            self.burst = float(burst)
+            self.tokens = float(burst)
+            self.updated = time.monotonic()
+
+    def take(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            # a negative balance is the wait of this caller
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            STATS.add('waited', wait)
+            time.sleep(wait)
+
+    def slow_down(self):
+        with self.lock:
+            self.rate = max(1.0, self.rate / 2)
+
+    def speed_up(self):
+        with self.lock:
+            self.rate = min(self.qps, self.rate + self.qps / 100)
+
+
+class ApiStats:
+    """
+    Counters of the api calls of this process, see summary().
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {'requests': 0, 'throttled': 0, 'server_errors': 0, 'retries': 0,
+                         'created': 0, 'existed': 0, 'waited': 0.0}
+
+    def add(self, key, value=1):
+        with self.lock:
+            self.counters[key] += value
+
+    def summary(self):
+        with self.lock:
+            c = dict(self.counters)
+        return ('{requests} api calls, {created} created, {existed} already existed, '
+                '{throttled} throttled (429), {server_errors} server errors, {retries} retries, '
+                '{waited:.1f}s rate limited, settled at {rate:.1f} qps').format(rate=BUCKET.rate, **c)
+
+
+STATS = ApiStats()
+BUCKET = TokenBucket(qps=20, burst=40)
+# retries of one call on 429/5xx, with backoff capped at MAX_BACKOFF seconds
+MAX_RETRIES = 8
+BASE_BACKOFF = 0.5
+MAX_BACKOFF = 30
+# how long create_or_get waits for an object being deleted to be gone
+DELETION_TIMEOUT = 300
+
+
+def configure_api(config):
+    """
+    Apply the optional `api` section of config.json: qps, burst, retries.
+    """
+    global MAX_RETRIES
+    section = config.get('api', {})
+    if section:
+        BUCKET.configure(section.get('qps', BUCKET.qps), section.get('burst', BUCKET.burst))
+        MAX_RETRIES = section.get('retries', MAX_RETRIES)
+
+
+def retry_delay(e, attempt):
+    """
+    Seconds to wait before retrying after `e`: the server's Retry-After if it
+    sent one, otherwise full-jitter exponential backoff.
+    """
+    retry_after = (e.headers or {}).get('Retry-After')
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            # an http-date, fall back to our own backoff
+            pass
+    return random.uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt))
+
+
+def call(method, *args, **kwargs):
+    """
+    Call a kubernetes api method through the rate limit, retrying on 429
+    and 5xx responses.
+    """
+    attempt = 0
+    while True:
+        BUCKET.take()
+        STATS.add('requests')
+        try:
+            result = method(*args, **kwargs)
+        except ApiException as e:
+            if e.status == 429:
+                STATS.add('throttled')
+                BUCKET.slow_down()
+            elif e.status is not None and e.status >= 500:
+                STATS.add('server_errors')
+            else:
+                raise
+            if attempt >= MAX_RETRIES:
+                raise
+            delay = retry_delay(e, attempt)
+            attempt += 1
+            STATS.add('retries')
+            logger.debug(f'{getattr(method, "__name__", method)} got {e.status}, retry {attempt} in {delay:.2f}s')
+            time.sleep(delay)
+            continue
+        BUCKET.speed_up()
+        return result
+
+
+class RateLimitedApi:
+    """
+    A kubernetes api object whose methods all go through call().
+
+    `connect_*` (exec/attach) methods are handed out unwrapped, stream()
+    needs their bound api client.
+    """
+    def __init__(self, api):
+        self.api = api
+
+    def __getattr__(self, name):
+        attr = getattr(self.api, name)
+        if not callable(attr) or name.startswith('connect_'):
+            return attr
+
+        def wrapped(*args, **kwargs):
+            return call(attr, *args, **kwargs)
+        wrapped.__name__ = name
+        return wrapped
+
+
+def core_api(own_client=False):
+    """
+    CoreV1Api, with `own_client` on a new ApiClient instead of the shared one.
+    """
+    load_config()
+    return RateLimitedApi(client.CoreV1Api(api_client=client.ApiClient() if own_client else None))
+
+
+def apps_api():
+    load_config()
+    return RateLimitedApi(client.AppsV1Api())
+
+
+def create_or_get(api, kind, body, namespace=None):
+    """
+    Create `body` with api.create_[namespaced_]<kind>, or return the object
+    already there under the same name. A create retried after a 5xx may have
+    gone through the first time, so this keeps reruns and retries idempotent.
+
+    An object still being deleted (a namespace in phase Terminating) is
+    waited out and then created anew, it would vanish under the caller.
+    """
+    name = body['metadata']['name']
+    prefix = 'namespaced_' if namespace is not None else ''
+    args = (namespace,) if namespace is not None else ()
+    deadline = time.time() + DELETION_TIMEOUT
+    while True:
+        try:
+            result = getattr(api, 'create_{}{}'.format(prefix, kind))(*args, body)
+            STATS.add('created')
+            return result
+        except ApiException as e:
+            if e.status != 409:
+                raise
+        try:
+            existing = getattr(api, 'read_{}{}'.format(prefix, kind))(name, *args)
+        except ApiException as e:
+            # deleted between the create and the read
+            if e.status != 404:
+                raise
+            continue
+        if existing.metadata.deletion_timestamp is None:
+            break
+        if time.time() > deadline:
+            raise RuntimeError('{} {} is still being deleted after {}s'.format(kind, name, DELETION_TIMEOUT))
+        logger.info(f'waiting for {kind} {name} to be deleted')
+        time.sleep(2)
+    STATS.add('existed')
+    logger.debug(f'{kind} {name} already exists')
+    return existing
+
+
+def pod_ips(namespace, names=None, wait=False):
+    """
+    Pod name -> current pod ip of the running pods of the namespace, or of
+    only `names`.
+
+    Pods reach each other by DNS name, this is for tools running outside the
+    cluster network. With `wait`, polls until every one of `names` runs.
+    """
+    while True:
+        ips = {pod.metadata.name: pod.status.pod_ip
+               for pod in core_api().list_namespaced_pod(namespace).items
+               if pod.status.phase == 'Running' and pod.status.pod_ip
+               and (names is None or pod.metadata.name in names)}
+        missing = [name for name in names or [] if name not in ips]
+        if not wait or not missing:
+            return ips
+        logger.info(f'waiting for {", ".join(missing)} to run')
+        time.sleep(1)
+
+
+def pack_files(files):
+    """
+    Pack files into one gzip compressed tar archive.
+
+    `files` maps the name inside the archive to either a local path (str)
+    or the file content (bytes).
+    """
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz') as tar:
+        for name, src in files.items():
+            if isinstance(src, str):
+                tar.add(src, arcname=name)
+                continue
+            info = tarfile.TarInfo(name)
+            info.size = len(src)
+            info.mode = 0o644
+            tar.addfile(info, io.BytesIO(src))
+    return buf.getvalue()
+
+
+def exec_script(namespace, pod, script, stdin=None, container=None, on_stdout=None):
+    """
+    Run `sh -c script` in a pod over a single exec session.
+
+    `stdin` (a str, or an iterable of str pieces) is streamed to the script
+    before waiting for it to exit. With `on_stdout`, stdout is handed to it
+    piece by piece instead of being collected.
+    Returns (ok, stdout, stderr).
+    """
+    # stream() swaps the request method of the api client it is given, so
+    # every session gets its own client to be safe from concurrent callers
+    api_instance = core_api(own_client=True)
+    BUCKET.take()
+    STATS.add('requests')
+    kwargs = {}
+    if container is not None:
+        kwargs['container'] = container
+    resp = stream(api_instance.connect_get_namespaced_pod_exec, pod, namespace,
+                  command=['sh', '-c', script],
+                  stdin=stdin is not None, stdout=True, stderr=True, tty=False,
+                  _preload_content=False, **kwargs)
+
+    if isinstance(stdin, str):
+        stdin = (stdin[offset:offset + STDIN_CHUNK] for offset in range(0, len(stdin), STDIN_CHUNK))
+    for piece in stdin or ():
+        resp.write_stdin(piece)
+
+    stdout, stderr, status = [], [], ''
+    while resp.is_open():
+        resp.update(timeout=1)
+        if resp.peek_stdout():
+            if on_stdout is not None:
+                on_stdout(resp.read_stdout())
+            else:
+                stdout.append(resp.read_stdout())
+        if resp.peek_stderr():
+            stderr.append(resp.read_stderr())
+        status += resp.read_channel(ERROR_CHANNEL)
+    resp.close()
+
+    # the error channel carries a v1.Status once the command exits
+    ok = status == '' or yaml.safe_load(status).get('status') == 'Success'
+    return ok, ''.join(stdout), ''.join(stderr)
+
+
+def upload_files(namespace, pod, files, dest, then=None, container=None):
+    """
+    Unpack `files` (see pack_files) into `dest` inside the pod and optionally
+    run the shell command `then` afterwards, all in one exec session.
+
+    The archive is base64 encoded so it survives the text websocket channel,
+    and `head -c` lets the remote side stop reading without closing stdin.
+    """
+    payload = base64.b64encode(pack_files(files)).decode()
+    script = 'mkdir -p {0} && head -c {1} | base64 -d | tar xzf - -C {0}'.format(dest, len(payload))
+    if then:
+        script += ' && {}'.format(then)
+
+    ok, out, err = exec_script(namespace, pod, script, stdin=payload, container=container)
+    if not ok:
+        raise RuntimeError('upload to {}/{} failed: {}'.format(namespace, pod, err.strip()))
+    logger.debug(f'Uploaded {len(files)} files to {pod}:{dest}')
+    return out
+
+
+def file_chunks(path):
+    """
+    A local file base64 encoded in STDIN_CHUNK sized pieces, read lazily.
+    """
+    # multiples of 3 bytes encode without padding, so the pieces concatenate
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(STDIN_CHUNK // 4 * 3)
+            if not data:
+                return
+            yield base64.b64encode(data).decode()
+
+
+def upload_archive(namespace, pod, path, dest, then=None, container=None):
+    """
+    Unpack the local tar archive `path` into `dest` inside the pod, streaming
+    it instead of loading it, so it may be larger than memory.
+    """
+    length = 4 * ((os.path.getsize(path) + 2) // 3)
+    flags = 'xzf' if path.endswith(('.gz', '.tgz')) else 'xf'
+    script = 'mkdir -p {0} && head -c {1} | base64 -d | tar {2} - -C {0}'.format(dest, length, flags)
+    if then:
+        script += ' && {}'.format(then)
+
+    ok, out, err = exec_script(namespace, pod, script, stdin=file_chunks(path), container=container)
+    if not ok:
+        raise RuntimeError('upload of {} to {}/{} failed: {}'.format(path, namespace, pod, err.strip()))
+    logger.debug(f'Unpacked {path} to {pod}:{dest}')
+    return out
+
+
+def download_archive(namespace, pod, src, path, exclude=(), container=None):
+    """
+    Pack the directory `src` inside the pod into the local tar.gz archive
+    `path`. The archive is streamed base64 encoded over stdout and decoded
+    on the fly, so it may be larger than memory.
+    """
+    excludes = ''.join(' --exclude={}'.format(e) for e in exclude)
+    # the exit status of a pipe is base64's, a failing tar has to say so
+    script = "{{ tar czf - -C {}{} . || echo 'tar failed' >&2; }} | base64".format(src, excludes)
+    rest = ['']
+    with open(path + '.tmp', 'wb') as f:
+        def write(piece):
+            data = rest[0] + piece.replace('\n', '')
+            cut = len(data) // 4 * 4
+            f.write(base64.b64decode(data[:cut]))
+            rest[0] = data[cut:]
+        ok, _, err = exec_script(namespace, pod, script, container=container, on_stdout=write)
+    if not ok or 'tar failed' in err or rest[0]:
+        os.remove(path + '.tmp')
+        raise RuntimeError('download of {}/{}:{} failed: {}'.format(namespace, pod, src, err.strip()))
+    os.rename(path + '.tmp', path)
+    logger.debug(f'Packed {pod}:{src} to {path}')
+
+
+def export_body(obj, kind, api_version):
+    """
+    An object read from the API server as a body create_or_get accepts
+    again, without the status and the metadata the server sets.
+    """
+    body = client.ApiClient().sanitize_for_serialization(obj)
+    body['apiVersion'] = api_version
+    body['kind'] = kind
+    body['metadata'] = {k: v for k, v in body['metadata'].items() if k in ('name', 'labels', 'annotations')}
+    body.pop('status', None)
+    return body
+
@@ -0,0 +1,380 @@
+import json
+import math
+import time
+import random
+import string
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from eth import create_eth_address, encode_call
+
+logger = logging.getLogger()
+
+# gas for one `transfer` call, skips an eth_estimateGas round trip per tx
+TRANSFER_GAS = hex(1000000)
+# 1 ether per load account, enough for a long run at dev gas prices
+FUND_VALUE = hex(10 ** 18)
+# balance given to every sender inside the source transfer contract
+SENDER_BALANCE = 10 ** 15
+# pending receivers checked per eth_call batch, oldest first
+POLL_BATCH = 64
+
+
+class JsonRpc:
+    """
+    JSON-RPC client for one geth node, keeping its connections pooled.
+    """
+    def __init__(self, url, pool_size=32):
+        self.url = url
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self._id = 0
+        self._lock = threading.Lock()
+
+    def _next_id(self):
+        with self._lock:
+            self._id += 1
+            return self._id
+
+    def call(self, method, *params):
+        body = {'jsonrpc': '2.0', 'id': self._next_id(), 'method': method, 'params': list(params)}
+        resp = self.session.post(self.url, json=body, timeout=30).json()
+        if 'error' in resp:
+            raise RuntimeError('{} {}: {}'.format(self.url, method, resp['error']['message']))
+        return resp['result']
+
+    def batch(self, calls):
+        """
+        Send several (method, params) calls in one request, results in order.
+        Failed calls come back as None.
+        """
+        if not calls:
+            return []
+        body = [{'jsonrpc': '2.0', 'id': i, 'method': m, 'params': list(p)} for i, (m, p) in enumerate(calls)]
+        resp = self.session.post(self.url, json=body, timeout=30).json()
+        results = [None] * len(calls)
+        for item in resp:
+            results[item['id']] = item.get('result')
+        return results
+
+    def wait_receipt(self, tx_hash, timeout=120):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            receipt = self.call('eth_getTransactionReceipt', tx_hash)
+            if receipt is not None:
+                return receipt
+            time.sleep(0.5)
+        raise TimeoutError('{} not mined on {}'.format(tx_hash, self.url))
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    # nearest-rank
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100.0 * len(values)) - 1)]
+
+
+class Route:
+    """
+    Interchain transfers from one appchain's transfer contract to another's.
+    """
+    def __init__(self, src, dst, deploy, chain_ips, pool_size):
+        self.name = '{}->{}'.format(src, dst)
+        self.src = deploy[src]
+        self.dst = deploy[dst]
+        self.src_rpc = JsonRpc('http://{}:8545'.format(chain_ips[src]), pool_size)
+        self.dst_rpc = JsonRpc('http://{}:8545'.format(chain_ips[dst]), pool_size)
+        # destination service id as registered by `register`
+        self.dst_did = '{}:{}:{}'.format(self.dst['bitxhub_id'], self.dst['id'], self.dst['transfer'])
+        self.tag = ''.join(random.choices(string.ascii_lowercase + string.digits, k=6))
+        self.senders = []
+        self.pending = {}
+        self.latencies = []
+        self.submitted = 0
+        self.failed = 0
+        self.first_submit = None
+        self.last_delivery = None
+        self.dst_height = None
+        self.lock = threading.Lock()
+
+    def prepare(self, num_senders):
+        """
+        Import eth.py accounts into the source geth, fund them from the
+        coinbase and credit them inside the source transfer contract.
+        """
+        rpc = self.src_rpc
+        coinbase = rpc.call('eth_coinbase')
+        password = ''.join(random.choices(string.ascii_letters + string.digits, k=10))
+        txs = []
+        for _ in range(num_senders):
+            account = create_eth_address()
+            address = rpc.call('personal_importRawKey', account['private_key'], password)
+            rpc.call('personal_unlockAccount', address, password, 0)
+            txs.append(rpc.call('eth_sendTransaction', {'from': coinbase, 'to': address, 'value': FUND_VALUE}))
+            self.senders.append(address)
+        for tx in txs:
+            rpc.wait_receipt(tx)
+
+        txs = [rpc.call('eth_sendTransaction', {
+            'from': sender, 'to': self.src['transfer'], 'gas': TRANSFER_GAS,
+            'data': encode_call('setBalance(string,uint64)', sender, SENDER_BALANCE),
+        }) for sender in self.senders]
+        for tx in txs:
+            rpc.wait_receipt(tx)
+
+    def submit(self, sender, seq):
+        # a receiver per tx, so its destination balance marks delivery
+        receiver = 'load-{}-{}'.format(self.tag, seq)
+        data = encode_call('transfer(string,string,string,string)', self.dst_did, sender, receiver, '1')
+        start = time.time()
+        try:
+            self.src_rpc.call('eth_sendTransaction', {
+                'from': sender, 'to': self.src['transfer'], 'gas': TRANSFER_GAS, 'data': data,
+            })
+        except Exception as e:
+            logger.warning(f'{self.name} submit failed: {e}')
+            with self.lock:
+                self.failed += 1
+            return
+        with self.lock:
+            self.submitted += 1
+            self.pending[receiver] = start
+            if self.first_submit is None:
+                self.first_submit = start
+
+    def poll(self):
+        """
+        Check the destination balances of the pending receivers once per new
+        destination block, so the chain under test is not flooded with calls.
+        Interchain txs of a route are delivered in order: receivers are
+        checked oldest first, POLL_BATCH at a time, until a batch still has
+        undelivered ones.
+        """
+        height = self.dst_rpc.call('eth_blockNumber')
+        if height == self.dst_height:
+            return
+        self.dst_height = height
+        # delivery happened when the block showed up, not when its batch returns
+        now = time.time()
+        with self.lock:
+            # dicts keep insertion order, i.e. submission order
+            receivers = list(self.pending)
+        for k in range(0, len(receivers), POLL_BATCH):
+            chunk = receivers[k:k + POLL_BATCH]
+            calls = [('eth_call', [{'to': self.dst['transfer'], 'data': encode_call('getBalance(string)', r)}, height])
+                     for r in chunk]
+            delivered = [r for r, result in zip(chunk, self.dst_rpc.batch(calls)) if result and int(result, 16) > 0]
+            with self.lock:
+                for receiver in delivered:
+                    self.latencies.append(now - self.pending.pop(receiver))
+                    self.last_delivery = now
+            if len(delivered) < len(chunk):
+                break
+
+    def report(self):
+        delivered = len(self.latencies)
+        elapsed = (self.last_delivery - self.first_submit) if delivered else 0
+        return {
+            'submitted': self.submitted,
+            'delivered': delivered,
+            'failed': self.failed,
+            'lost': len(self.pending),
+            'tps': round(delivered / elapsed, 2) if elapsed > 0 else 0,
+            'p50': percentile(self.latencies, 50),
+            'p95': percentile(self.latencies, 95),
+            'p99': percentile(self.latencies, 99),
+        }
+
+
+def default_routes(deploy):
+    """
+    Every ordered pair of appchains attached to the same bitxhub.
+    """
+    routes = []
+    for a, x in deploy.items():
+        for b, y in deploy.items():
+            if a != b and x['bitxhub_id'] == y['bitxhub_id']:
+                routes.append([a, b])
+    return routes
+
+
+def run_load(namespace, load_config, on_window=None):
+    """
+    Push interchain transfers through the registered network and report
+    TPS and end-to-end latency (source submission -> destination state) per route.
+    `on_window`, if given, is called with 'start' once the senders are
+    prepared and with 'end' once they stopped submitting.
+
+    load_config keys:
+      routes:   [[src appchain id, dst appchain id], ...], defaults to every
+                pair under the same bitxhub
+      rate:     target tx/s per route, 0 means as fast as possible
+      duration: seconds of load
+      senders:  accounts (and submit threads) per route
+      timeout:  seconds to keep waiting for in-flight txs after the load ends
+    """
+    # the kubernetes client is only needed for the pod ips, not to import load
+    from kube import pod_ips
+    with open("deploy_{}.json".format(namespace)) as f:
+        deploy_json = json.load(f)
+
+    # deploy_{ns}.json is keyed by geth pod, routes use appchain ids
+    deploy = {item['id']: item for item in deploy_json.values()}
+    ips = pod_ips(namespace, list(deploy_json), wait=True)
+    chain_ips = {item['id']: ips[name] for name, item in deploy_json.items()}
+
+    rate = load_config.get('rate', 0)
+    duration = load_config.get('duration', 60)
+    num_senders = load_config.get('senders', 4)
+    timeout = load_config.get('timeout', 120)
+    route_pairs = load_config.get('routes') or default_routes(deploy)
+
+    routes = [Route(src, dst, deploy, chain_ips, num_senders + 2) for src, dst in route_pairs]
+    logger.info(f'Preparing {len(routes)} routes with {num_senders} senders each')
+    with ThreadPoolExecutor(max_workers=max(len(routes), 1)) as pool:
+        for future in [pool.submit(route.prepare, num_senders) for route in routes]:
+            future.result()
+
+    stop = threading.Event()
+
+    def sender_loop(route, sender, index):
+        # every sender gets an equal share of the route's target rate
+        interval = num_senders / rate if rate else 0
+        seq = index
+        next_at = time.time()
+        while not stop.is_set():
+            route.submit(sender, seq)
+            seq += num_senders
+            if interval:
+                next_at += interval
+                time.sleep(max(0, next_at - time.time()))
+
+    def tracker_loop():
+        deadline = None
+        while True:
+            for route in routes:
+                try:
+                    route.poll()
+                except Exception as e:
+                    logger.warning(f'{route.name} poll failed: {e}')
+            if stop.is_set():
+                deadline = deadline or time.time() + timeout
+                if time.time() > deadline or not any(route.pending for route in routes):
+                    return
+            time.sleep(0.2)
+
+    logger.info(f'Generating load for {duration}s ({rate or "max"} tx/s per route)')
+    if on_window:
+        on_window('start')
+    threads = [threading.Thread(target=sender_loop, args=(route, sender, k), daemon=True)
+               for route in routes for k, sender in enumerate(route.senders)]
+    tracker = threading.Thread(target=tracker_loop, daemon=True)
+    for t in threads + [tracker]:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    if on_window:
+        on_window('end')
+    logger.info('Load finished, waiting for in-flight interchain txs')
+    tracker.join()
+
+    result = {route.name: route.report() for route in routes}
+    print('{:<40} {:>9} {:>9} {:>6} {:>6} {:>8} {:>8} {:>8} {:>8}'.format(
+        'route', 'submitted', 'delivered', 'failed', 'lost', 'tps', 'p50(s)', 'p95(s)', 'p99(s)'))
+    fmt = lambda v: '-' if v is None else '{:.3f}'.format(v)
+    for name, r in result.items():
+        print('{:<40} {:>9} {:>9} {:>6} {:>6} {:>8} {:>8} {:>8} {:>8}'.format(
+            name, r['submitted'], r['delivered'], r['failed'], r['lost'], r['tps'],
+            fmt(r['p50']), fmt(r['p95']), fmt(r['p99'])))
+
+    json.dump(result, open("load_{}.json".format(namespace), "w"), indent=4)
+    return result
+
+
+def chain_stats(rpc, start, end):
+    """
+    Block time and tx/s of the blocks after `start` up to `end` on one chain.
+    """
+    calls = [('eth_getBlockByNumber', [hex(n), False]) for n in range(start, end + 1)]
+    blocks = [b for b in rpc.batch(calls) if b]
+    if len(blocks) < 2:
+        return None
+    times = [int(b['timestamp'], 16) for b in blocks]
+    # the txs of the first block were sealed before the window started
+    txs = sum(len(b['transactions']) for b in blocks[1:])
+    gas_used = sum(int(b['gasUsed'], 16) for b in blocks[1:])
+    gas_limit = sum(int(b['gasLimit'], 16) for b in blocks[1:])
+    elapsed = times[-1] - times[0]
+    return {
+        'blocks': len(blocks) - 1,
+        'elapsed': elapsed,
+        'txs': txs,
+        'gas': gas_used / gas_limit if gas_limit else 0,
+    }
+
+
+def compare_profiles(namespace, load_config):
+    """
+    Run the interchain load once and report, per geth profile, the block
+    time and tx/s the appchains of that profile achieved meanwhile.
+    Only the blocks sealed while the senders were submitting count, the
+    funding and setBalance txs of the preparation stay out of the figures.
+    """
+    from kube import pod_ips
+    with open("graph_{}.json".format(namespace)) as f:
+        graph = json.load(f)
+    ips = pod_ips(namespace, [name for item in graph.values() for name in item['chainNameList']], wait=True)
+    chains = []
+    for item in graph.values():
+        # graphs written before geth profiles only ran dev geths
+        profiles = item.get('chainProfileList', ['dev'] * len(item['chainNameList']))
+        for name, profile in zip(item['chainNameList'], profiles):
+            chains.append((profile, JsonRpc('http://{}:8545'.format(ips[name]))))
+
+    heights = {}
+
+    def mark(phase):
+        heights[phase] = [int(rpc.call('eth_blockNumber'), 16) for _, rpc in chains]
+
+    load = run_load(namespace, load_config, on_window=mark)
+    start, end = heights['start'], heights['end']
+
+    totals = {}
+    for (profile, rpc), a, b in zip(chains, start, end):
+        stats = chain_stats(rpc, a, b)
+        total = totals.setdefault(profile, {'chains': 0, 'blocks': 0, 'elapsed': 0, 'txs': 0, 'gas': []})
+        total['chains'] += 1
+        if stats is None:
+            logger.warning(f'{rpc.url} sealed less than 2 blocks during the run')
+            continue
+        total['blocks'] += stats['blocks']
+        total['elapsed'] += stats['elapsed']
+        total['txs'] += stats['txs']
+        total['gas'].append(stats['gas'])
+
+    result = {}
+    for profile, t in totals.items():
+        result[profile] = {
+            'chains': t['chains'],
+            'blocks': t['blocks'],
+            'block_time': round(t['elapsed'] / t['blocks'], 3) if t['blocks'] else None,
+            # per chain, so profiles with a different number of appchains compare
+            'tps': round(t['txs'] / t['elapsed'], 2) if t['elapsed'] else 0,
+            'gas_used': round(sum(t['gas']) / len(t['gas']), 4) if t['gas'] else None,
+        }
+
+    print('{:<20} {:>6} {:>7} {:>13} {:>8} {:>9}'.format('profile', 'chains', 'blocks', 'block time(s)', 'tx/s', 'gas used'))
+    fmt = lambda v, f: '-' if v is None else f.format(v)
+    for profile, r in result.items():
+        print('{:<20} {:>6} {:>7} {:>13} {:>8} {:>9}'.format(
+            profile, r['chains'], r['blocks'], fmt(r['block_time'], '{:.3f}'), r['tps'], fmt(r['gas_used'], '{:.2%}')))
+
+    json.dump({'profiles': result, 'routes': load}, open("compare_{}.json".format(namespace), "w"), indent=4)
+    return result
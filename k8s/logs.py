@@ -0,0 +1,262 @@
+import os
+import re
+import csv
+import time
+import logging
+import datetime
+import threading
+import logging.handlers
+
+from kubernetes.stream import stream
+
+from kube import core_api
+
+logger = logging.getLogger()
+
+# rotate every followed log at 64MB, keeping 5 old files
+MAX_BYTES = 64 << 20
+BACKUP_COUNT = 5
+# how often the namespace is rescanned for new pods
+RESCAN_INTERVAL = 10
+# an ibtp not seen again for this long is forgotten, its tx is lost or done
+IBTP_TTL = 600
+
+# (event, regex) tried in order against every line; the ibtp id (from-to-index)
+# chains the hops of one interchain tx across pods, `height` names a block
+EVENTS = [
+    ('received', re.compile(r'(?i)(receive|get|new|handle)\w* (interchain )?ibtp')),
+    ('submitted', re.compile(r'(?i)(send|submit)\w* (interchain )?ibtp|ibtp\w* (sent|submitted)')),
+    ('confirmed', re.compile(r'(?i)(confirm|receipt)\w* (interchain )?ibtp|ibtp\w* (confirmed|executed)')),
+    ('block', re.compile(r'(?i)block committed|persisted block|imported new chain segment|sealed new block')),
+]
+IBTP_ID = re.compile(r'\b(?:ibtp_id|ibtpID|ibtp|id)=["\']?(?P<id>[^\s"\'-]+-[^\s"\'-]+-\d+)\b')
+# lines that log the parts of the id as separate fields instead
+IBTP_FIELDS = [re.compile(r'\b{}=["\']?(?P<value>[^\s"\']+)'.format(field)) for field in ('from', 'to', 'index')]
+HEIGHT = re.compile(r'\b(?:height|number)=["\']?(?P<height>\d+)')
+# logrus: time="2021-06-09T14:49:34.123+08:00"
+LOGRUS_TIME = re.compile(r'time="(?P<time>[^"]+)"')
+
+# bitxhub-in-one runs 4 nodes under tmux, their logs only live in the repos
+BITXHUB_LOGS = '/root/bitxhub/scripts/build/node{}/logs/bitxhub.log'
+# stream name of one of those nodes, see log_sources
+BITXHUB_NODE = re.compile(r'^(?P<chain>bitxhub-\d+)-node\d+$')
+
+
+def parse_time(line, default):
+    match = LOGRUS_TIME.search(line)
+    if not match:
+        return default
+    value = match.group('time')
+    # %z in python 3.6 does not accept the colon of "+08:00"
+    if len(value) > 6 and value[-3] == ':':
+        value = value[:-3] + value[-2:]
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f%z', '%Y-%m-%dT%H:%M:%S%z'):
+        try:
+            return datetime.datetime.strptime(value, fmt).timestamp()
+        except ValueError:
+            pass
+    return default
+
+
+def classify(line):
+    for event, pattern in EVENTS:
+        if pattern.search(line):
+            return event
+    return None
+
+
+def ibtp_id(line):
+    match = IBTP_ID.search(line)
+    if match:
+        return match.group('id')
+    fields = [pattern.search(line) for pattern in IBTP_FIELDS]
+    if not all(fields):
+        return None
+    return '-'.join(field.group('value') for field in fields)
+
+
+def log_sources(pod):
+    """
+    Where to follow a pod's log: (stream name, shell command or None for stdout).
+    """
+    name = pod.metadata.name
+    if name.startswith('union-'):
+        # started as `pier start > log.txt` in the container's workdir
+        return [(name, 'tail -n +1 -F log.txt')]
+    if name.startswith('bitxhub-'):
+        return [('{}-node{}'.format(name, n), 'tail -n +1 -F {}'.format(BITXHUB_LOGS.format(n)))
+                for n in range(1, 5)]
+    return [(name, None)]
+
+
+class LatencyTracker:
+    """
+    Chains events of the same ibtp into per-hop latencies and appends them,
+    as well as block commits, to a csv time-series.
+    """
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.last = {}
+        self.hops = {}
+        self.pruned_at = time.time()
+        self.file = open(path, 'a', newline='')
+        self.writer = csv.writer(self.file)
+        if self.file.tell() == 0:
+            self.writer.writerow(['time', 'kind', 'id', 'from', 'to', 'latency'])
+
+    def record(self, source, event, line, ts):
+        if event == 'block':
+            match = HEIGHT.search(line)
+            height = match.group('height') if match else ''
+            with self.lock:
+                self.writer.writerow([ts, 'block', height, source, source, ''])
+            return
+
+        ibtp = ibtp_id(line)
+        if ibtp is None:
+            return
+        # the 4 nodes of a relay chain log the same ibtp, they are one hop
+        match = BITXHUB_NODE.match(source)
+        if match:
+            source = match.group('chain')
+        hop = '{}:{}'.format(source, event)
+        with self.lock:
+            self.prune()
+            prev = self.last.get(ibtp)
+            if prev is not None and (ts < prev[1] or prev[0] == hop):
+                # pods' clocks or a resumed stream put this line out of order,
+                # or another node repeats the hop: neither says anything new
+                return
+            if event == 'confirmed':
+                # the last hop of the ibtp, nothing left to chain to it
+                self.last.pop(ibtp, None)
+            else:
+                self.last[ibtp] = (hop, ts, time.time())
+            if prev is None:
+                return
+            latency = ts - prev[1]
+            self.hops.setdefault((prev[0], hop), []).append(latency)
+            self.writer.writerow([ts, 'hop', ibtp, prev[0], hop, '{:.6f}'.format(latency)])
+            self.file.flush()
+
+    def prune(self):
+        # called with the lock held
+        now = time.time()
+        if now - self.pruned_at < IBTP_TTL:
+            return
+        self.pruned_at = now
+        # by when the line was read, replayed logs carry old timestamps
+        self.last = {ibtp: last for ibtp, last in self.last.items() if now - last[2] < IBTP_TTL}
+
+    def summary(self):
+        # load.py pulls in requests and eth, only needed for the summary
+        from load import percentile
+        with self.lock:
+            rows = [(a, b, len(v), percentile(v, 50), percentile(v, 95), max(v))
+                    for (a, b), v in self.hops.items()]
+        # slowest hops first, these are the bottlenecks
+        return sorted(rows, key=lambda r: r[4], reverse=True)
+
+
+class LogCollector:
+    """
+    Follow the logs of every pod in a namespace concurrently.
+    """
+    def __init__(self, namespace, out_dir):
+        self.namespace = namespace
+        self.out_dir = out_dir
+        os.makedirs(out_dir, exist_ok=True)
+        self.tracker = LatencyTracker(os.path.join(out_dir, 'latency.csv'))
+        self.followed = set()
+        self.stop = threading.Event()
+
+    def _file_logger(self, source):
+        file_logger = logging.getLogger('logs.{}.{}'.format(self.namespace, source))
+        file_logger.propagate = False
+        file_logger.setLevel(logging.INFO)
+        if not file_logger.handlers:
+            handler = logging.handlers.RotatingFileHandler(
+                os.path.join(self.out_dir, '{}.log'.format(source)),
+                maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            file_logger.addHandler(handler)
+        return file_logger
+
+    def handle(self, source, file_logger, line):
+        file_logger.info(line)
+        event = classify(line)
+        if event is not None:
+            self.tracker.record(source, event, line, parse_time(line, time.time()))
+
+    def _lines_from_stdout(self, pod_name, since=None):
+        api_instance = core_api(own_client=True)
+        kwargs = {} if since is None else {'since_seconds': since}
+        resp = api_instance.read_namespaced_pod_log(pod_name, self.namespace, follow=True,
+                                                    _preload_content=False, **kwargs)
+        for line in resp:
+            if self.stop.is_set():
+                break
+            yield line.decode(errors='replace').rstrip('\n')
+        resp.release_conn()
+
+    def _lines_from_exec(self, pod_name, command):
+        # each exec session needs its own api client, see kube.exec_script
+        api_instance = core_api(own_client=True)
+        resp = stream(api_instance.connect_get_namespaced_pod_exec, pod_name, self.namespace,
+                      command=['sh', '-c', command], stderr=False, stdin=False,
+                      stdout=True, tty=False, _preload_content=False)
+        pending = ''
+        while resp.is_open() and not self.stop.is_set():
+            resp.update(timeout=1)
+            if resp.peek_stdout():
+                pending += resp.read_stdout()
+                *lines, pending = pending.split('\n')
+                for line in lines:
+                    yield line
+        resp.close()
+
+    def follow(self, pod_name, source, command):
+        file_logger = self._file_logger(source)
+        resumed = False
+        while not self.stop.is_set():
+            # after a dropped stream only pick up what was logged meanwhile
+            try:
+                if command is None:
+                    lines = self._lines_from_stdout(pod_name, RESCAN_INTERVAL + 1 if resumed else None)
+                else:
+                    lines = self._lines_from_exec(pod_name, command.replace('-n +1', '-n 0') if resumed else command)
+                for line in lines:
+                    self.handle(source, file_logger, line)
+            except Exception as e:
+                logger.debug(f'log stream {source} interrupted: {e}')
+            resumed = True
+            if self.stop.wait(RESCAN_INTERVAL):
+                break
+
+    def scan(self):
+        api_instance = core_api()
+        pods = api_instance.list_namespaced_pod(self.namespace).items
+        for pod in pods:
+            if pod.status.phase != 'Running':
+                continue
+            for source, command in log_sources(pod):
+                if source in self.followed:
+                    continue
+                self.followed.add(source)
+                logger.info(f'Following {source}')
+                threading.Thread(target=self.follow, args=(pod.metadata.name, source, command),
+                                 daemon=True).start()
+
+    def run(self, duration=None):
+        deadline = time.time() + duration if duration else None
+        try:
+            while deadline is None or time.time() < deadline:
+                self.scan()
+                time.sleep(RESCAN_INTERVAL)
+        except KeyboardInterrupt:
+            pass
+        self.stop.set()
+
+        print('{:<50} {:<50} {:>7} {:>9} {:>9} {:>9}'.format('from', 'to', 'count', 'p50(s)', 'p95(s)', 'max(s)'))
+        for a, b, count, p50, p95, worst in self.tracker.summary():
+            print('{:<50} {:<50} {:>7} {:>9.3f} {:>9.3f} {:>9.3f}'.format(a, b, count, p50, p95, worst))
@@ -0,0 +1,285 @@
+import json
+import time
+import socket
+import logging
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from kube import core_api
+from load import JsonRpc
+
+logger = logging.getLogger()
+
+# bitxhub-in-one runs 4 nodes, node n serves its gateway on 909n
+BITXHUB_NODES = 4
+BITXHUB_GATEWAY = 'http://{}:909{}/v1/chain_meta'
+# [port] http of pier.toml, the pier api server
+PIER_HTTP_PORT = 44544
+
+
+class Target:
+    """
+    Last sample of one polled endpoint, and since when its height stands still.
+    """
+    def __init__(self, kind, labels):
+        self.kind = kind
+        self.labels = labels
+        self.up = 0
+        self.values = {}
+        self.height = None
+        self.moved_at = time.time()
+
+    def sample(self, up, height=None, **values):
+        self.up = up
+        self.values = values
+        if height is not None and height != self.height:
+            self.height = height
+            self.moved_at = time.time()
+
+    def still_for(self):
+        return time.time() - self.moved_at
+
+
+class Monitor:
+    """
+    Polls every geth, bitxhub node and pier of a network concurrently and
+    keeps the latest samples and alerts for the metrics endpoint.
+
+    monitor_config keys:
+      port:        port of the Prometheus endpoint
+      interval:    seconds between polls
+      stall_after: seconds a height may stand still before a stall alert
+      lag:         blocks a bitxhub node may trail its fastest peer
+    """
+    def __init__(self, namespace, monitor_config):
+        self.namespace = namespace
+        self.interval = monitor_config.get('interval', 5)
+        self.stall_after = monitor_config.get('stall_after', 60)
+        self.max_lag = monitor_config.get('lag', 5)
+        self.port = monitor_config.get('port', 9100)
+        self.lock = threading.Lock()
+        self.alerts = {}
+        self.polls = 0
+
+        with open("graph_{}.json".format(namespace)) as f:
+            graph = json.load(f)
+        appchains = {}
+        try:
+            with open("deploy_{}.json".format(namespace)) as f:
+                appchains = {name: item['id'] for name, item in json.load(f).items()}
+        except FileNotFoundError:
+            pass
+
+        # targets are pods, their ips are looked up again every poll so a
+        # restarted StatefulSet pod is followed to its new ip
+        self.geths, self.bitxhubs, self.piers = [], [], {}
+        for bitxhubName, item in graph.items():
+            # graphs written before geth profiles only ran dev geths
+            profiles = item.get('chainProfileList', ['dev'] * len(item['chainNameList']))
+            for name, profile in zip(item['chainNameList'], profiles):
+                target = Target('geth', {'pod': name, 'appchain': appchains.get(name, ''), 'bitxhub': bitxhubName})
+                target.ip = target.rpc = None
+                # --dev only seals when there are txs, so only a full pool means a stall
+                target.sealing = profile != 'dev'
+                self.geths.append(target)
+            for n in range(1, BITXHUB_NODES + 1):
+                self.bitxhubs.append(Target('bitxhub', {'bitxhub': bitxhubName, 'node': str(n)}))
+
+        # one pooled session for every bitxhub gateway
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=len(self.bitxhubs) or 1, pool_maxsize=4)
+        self.session.mount('http://', adapter)
+        # at most one relay pier per appchain and one union pier per bitxhub
+        workers = 2 * len(self.geths) + len(self.bitxhubs) + len(graph)
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+    def poll_geth(self, target, ip):
+        if ip is None:
+            target.sample(0)
+            return
+        if ip != target.ip:
+            target.ip = ip
+            target.rpc = JsonRpc('http://{}:8545'.format(ip), pool_size=1)
+        try:
+            height, txpool = target.rpc.batch([('eth_blockNumber', []), ('txpool_status', [])])
+        except Exception as e:
+            logger.debug(f'{target.labels["pod"]}: {e}')
+            target.sample(0)
+            return
+        values = {}
+        # nodes started without the txpool api answer with an error
+        if txpool:
+            values = {'pending': int(txpool['pending'], 16), 'queued': int(txpool['queued'], 16)}
+        target.sample(1, int(height, 16) if height else None, **values)
+
+    def poll_bitxhub(self, target, ip):
+        if ip is None:
+            target.sample(0)
+            return
+        url = BITXHUB_GATEWAY.format(ip, target.labels['node'])
+        try:
+            meta = self.session.get(url, timeout=self.interval).json()
+        except Exception as e:
+            logger.debug(f'{url}: {e}')
+            target.sample(0)
+            return
+        target.sample(1, int(meta['height']))
+
+    def poll_pier(self, target, pod):
+        """
+        Pod state of a relay or union pier, plus whether its api port accepts
+        connections, which is no sign the pier relays.
+        """
+        restarts = sum(s.restart_count for s in pod.status.container_statuses or [])
+        port_open = 0
+        if pod.status.phase == 'Running' and pod.status.pod_ip:
+            try:
+                socket.create_connection((pod.status.pod_ip, PIER_HTTP_PORT), timeout=2).close()
+                port_open = 1
+            except OSError:
+                pass
+        target.sample(port_open, restarts=restarts, running=int(pod.status.phase == 'Running'))
+
+    def alert(self, key, firing, message):
+        with self.lock:
+            was = self.alerts.get(key, False)
+            self.alerts[key] = firing
+        if firing and not was:
+            logger.warning(f'ALERT {message}')
+        elif was and not firing:
+            logger.info(f'resolved {message}')
+
+    def evaluate(self):
+        for target in self.geths:
+            name = target.labels['pod']
+            self.alert(('geth_down', name), not target.up, f'geth {name} unreachable')
+            busy = target.sealing or target.values.get('pending', 0) > 0
+            stalled = bool(target.up and busy and target.still_for() > self.stall_after)
+            self.alert(('geth_stall', name), stalled,
+                       f'geth {name} stuck at block {target.height} for {target.still_for():.0f}s')
+
+        best = {}
+        for target in self.bitxhubs:
+            if target.up:
+                bitxhub = target.labels['bitxhub']
+                best[bitxhub] = max(best.get(bitxhub, 0), target.height)
+        for target in self.bitxhubs:
+            name = '{}/node{}'.format(target.labels['bitxhub'], target.labels['node'])
+            target.lag = best.get(target.labels['bitxhub'], 0) - target.height if target.up else None
+            self.alert(('bitxhub_down', name), not target.up, f'bitxhub {name} unreachable')
+            self.alert(('bitxhub_lag', name), bool(target.up and target.lag > self.max_lag),
+                       f'bitxhub {name} {target.lag} blocks behind')
+
+        for name, target in list(self.piers.items()):
+            self.alert(('pier_port_closed', name), not target.up, f'pier {name} api port {PIER_HTTP_PORT} closed')
+
+    def poll(self):
+        try:
+            pods = core_api().list_namespaced_pod(self.namespace).items
+        except Exception as e:
+            logger.warning(f'listing pods failed: {e}')
+            pods = []
+        ips = {pod.metadata.name: pod.status.pod_ip for pod in pods if pod.status.pod_ip}
+        futures = [self.pool.submit(self.poll_geth, t, ips.get(t.labels['pod'])) for t in self.geths]
+        futures += [self.pool.submit(self.poll_bitxhub, t, ips.get(t.labels['bitxhub'])) for t in self.bitxhubs]
+        for pod in pods:
+            name = pod.metadata.name
+            if not name.startswith(('pier-', 'union-')):
+                continue
+            target = self.piers.get(name)
+            if target is None:
+                target = self.piers[name] = Target('pier', {'pod': name})
+            futures.append(self.pool.submit(self.poll_pier, target, pod))
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                logger.warning(f'poll failed: {e}')
+        self.evaluate()
+        self.polls += 1
+
+    def metrics(self):
+        """
+        The latest samples in the Prometheus text exposition format.
+        """
+        lines = []
+
+        def metric(name, help_text, kind, samples):
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for labels, value in samples:
+                if value is None:
+                    continue
+                label_text = ','.join('{}="{}"'.format(k, v) for k, v in sorted(labels.items()))
+                lines.append('{}{} {}'.format(name, '{' + label_text + '}' if label_text else '', value))
+
+        metric('interchain_geth_up', 'geth answers json-rpc', 'gauge',
+               [(t.labels, t.up) for t in self.geths])
+        metric('interchain_geth_block_height', 'latest geth block', 'gauge',
+               [(t.labels, t.height) for t in self.geths])
+        metric('interchain_geth_txpool_pending', 'executable txs in the geth txpool', 'gauge',
+               [(t.labels, t.values.get('pending')) for t in self.geths])
+        metric('interchain_geth_txpool_queued', 'non-executable txs in the geth txpool', 'gauge',
+               [(t.labels, t.values.get('queued')) for t in self.geths])
+        metric('interchain_geth_block_age_seconds', 'seconds since the geth height last moved', 'gauge',
+               [(t.labels, round(t.still_for(), 1)) for t in self.geths])
+        metric('interchain_bitxhub_up', 'bitxhub node gateway answers', 'gauge',
+               [(t.labels, t.up) for t in self.bitxhubs])
+        metric('interchain_bitxhub_height', 'bitxhub node chain height', 'gauge',
+               [(t.labels, t.height) for t in self.bitxhubs])
+        metric('interchain_bitxhub_lag_blocks', 'blocks behind the highest node of the same bitxhub', 'gauge',
+               [(t.labels, getattr(t, 'lag', None)) for t in self.bitxhubs])
+        metric('interchain_pier_port_open', 'pier api port accepts tcp connections', 'gauge',
+               [(t.labels, t.up) for t in list(self.piers.values())])
+        metric('interchain_pier_restarts_total', 'container restarts of the pier pod', 'counter',
+               [(t.labels, t.values.get('restarts')) for t in list(self.piers.values())])
+        with self.lock:
+            alerts = dict(self.alerts)
+        metric('interchain_alert', 'locally evaluated alert, 1 while firing', 'gauge',
+               [({'alert': kind, 'target': name}, int(firing)) for (kind, name), firing in sorted(alerts.items())])
+        metric('interchain_monitor_polls_total', 'completed poll rounds', 'counter', [({}, self.polls)])
+        return '\n'.join(lines) + '\n'
+
+    def serve(self):
+        monitor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = monitor.metrics().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        # ThreadingHTTPServer is 3.7+
+        class Server(socketserver.ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        server = Server(('0.0.0.0', self.port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def run(self):
+        server = self.serve()
+        logger.info(f'Monitoring {len(self.geths)} geth, {len(self.bitxhubs)} bitxhub nodes, '
+                    f'metrics on http://0.0.0.0:{self.port}/metrics')
+        try:
+            while True:
+                started = time.time()
+                self.poll()
+                time.sleep(max(0, self.interval - (time.time() - started)))
+        except KeyboardInterrupt:
+            pass
+        server.shutdown()
+        self.pool.shutdown(wait=False)
@@ -0,0 +1,1409 @@
+import pathlib
+import json
+import yaml
+import random
+import string
+import base64
+import logging
+import os.path as osp
+import os
+import time 
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from kubernetes import client
+from kubernetes.client.rest import ApiException
+
+from kube import core_api, apps_api, configure_api, create_or_get, exec_script, pod_ips, upload_files, upload_archive
+from resources import role_resources, apply_resources, check_capacity
+from planner import load_plan, late_values, plan_manifest, plan_repo, render, render_file, render_repo
+
+logger = logging.getLogger()
+
+encode = lambda s: base64.b64encode(str.encode(s)).decode()
+
+# chaindata of the light client, geth's default datadir in its image
+LIGHT_DATADIR = "/root/.ethereum"
+
+# the node this tool runs on; it already holds every binary locally
+LOCAL_NODE_IP = "10.206.0.7"
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def binary_cache_paths(config):
+    """
+    Config key (`pier`, `root_pier`, ...) -> path of that build in the
+    per-node bin-cache, named after its content hash.
+    """
+    cache_dir = osp.join(config["base"], "bin-cache")
+    paths = {}
+    for key in ("pier", "root_pier", "bitxhub", "root_bitxhub"):
+        if key not in config:
+            continue
+        digest = file_digest(config[key])
+        paths[key] = osp.join(cache_dir, "{}-{}".format(key, digest[:16]))
+    return paths
+
+
+def binary_variant(config, kind, index):
+    """
+    Config key of the `pier`/`bitxhub` build used by the index-th relay chain.
+
+    The first relay chain (root) runs the `root_` build when one is configured.
+    """
+    root = "root_{}".format(kind)
+    if index == 0 and root in config:
+        return root
+    return kind
+
+
+def set_volume_path(body, name, path, type="File"):
+    for volume in body['spec']['volumes']:
+        if volume['name'] == name:
+            volume['hostPath']['path'] = path
+            volume['hostPath']['type'] = type
+            return
+    raise KeyError(name)
+
+
+class GethLightClient:
+    """
+    Geth Light Client
+    """
+    def __init__(self, name):
+        self.name = name
+        self.k8s_config_dir = pathlib.Path('k8s-geth-light-client/')
+
+    def create_namespace(self):
+        config = self.k8s_config_dir / 'namespace.yaml'
+        with config.open() as f:
+            body = yaml.safe_load(f)
+
+        body['metadata']['name'] = self.name
+
+        create_or_get(core_api(), 'namespace', body)
+
+        logger.debug(f'Created namespace "{self.name}"')
+
+    def delete_namespace(self):
+        try:
+            v1 = core_api()
+            v1.delete_namespace(name=self.name, body=client.V1DeleteOptions())
+        except ApiException as e:
+            if e.status == 404:
+                # don't throw if namespace doesn't exist
+                return
+            else:
+                raise
+        logger.debug(f'Deleted namespace "{self.name}"')
+
+    def create_service(self):
+        config = self.k8s_config_dir / 'service.yaml'
+        with config.open() as f:
+            body = yaml.safe_load(f)
+
+        create_or_get(core_api(), 'service', body, self.name)
+
+        logger.debug('Created Service')
+
+    def create_deployment(self, body=None):
+        if body is None:
+            config = self.k8s_config_dir / 'deployment.yaml'
+            with config.open() as f:
+                body = yaml.safe_load(f)
+
+        create_or_get(apps_api(), 'deployment', body, self.name)
+
+        logger.debug('Created Deployment')
+
+    def create(self):
+        self.create_namespace()
+        self.create_service()
+        self.create_deployment()
+
+    def chaindata_volume_name(self):
+        return '{}-chaindata'.format(self.name)
+
+    def create_chaindata(self, light):
+        """
+        Claim this client's cluster scoped chaindata volume, creating it on
+        first use. The volume is retained when the namespace goes away, so a
+        later --create picks up the same chaindata.
+        """
+        api_instance = core_api()
+        volumeName = self.chaindata_volume_name()
+        try:
+            volume = api_instance.read_persistent_volume(volumeName)
+            if volume.status.phase == 'Released':
+                # the old claim went away with the namespace, let the new one bind
+                api_instance.patch_persistent_volume(volumeName, {'spec': {'claimRef': None}})
+            logger.info(f'Reusing chaindata volume "{volumeName}"')
+        except ApiException as e:
+            if e.status != 404:
+                raise
+            with (self.k8s_config_dir / 'persistentvolume.yaml').open() as f:
+                body = yaml.safe_load(f)
+            body['metadata']['name'] = volumeName
+            body['spec']['capacity']['storage'] = light['storage']
+            body['spec']['hostPath']['path'] = light.get('path', osp.join('/data/geth-light', self.name))
+            # a hostPath volume only holds its data on one node, create_by_config requires it
+            if 'node' in light:
+                body['spec']['nodeAffinity'] = {'required': {'nodeSelectorTerms': [{'matchExpressions': [
+                    {'key': 'kubernetes.io/hostname', 'operator': 'In', 'values': [light['node']]}]}]}}
+            create_or_get(api_instance, 'persistent_volume', body)
+            logger.info(f'Created chaindata volume "{volumeName}"')
+
+        with (self.k8s_config_dir / 'persistentvolumeclaim.yaml').open() as f:
+            body = yaml.safe_load(f)
+        body['spec']['volumeName'] = volumeName
+        body['spec']['resources']['requests']['storage'] = light['storage']
+        create_or_get(api_instance, 'persistent_volume_claim', body, self.name)
+
+    def persistent_deployment_body(self, light):
+        with (self.k8s_config_dir / 'deployment.yaml').open() as f:
+            body = yaml.safe_load(f)
+
+        # one writer per chaindata, and the old pod has to let go of it first
+        body['spec']['replicas'] = 1
+        body['spec']['strategy'] = {'type': 'Recreate'}
+        spec = body['spec']['template']['spec']
+        container = spec['containers'][0]
+        container['volumeMounts'] = [{'name': 'geth-datadir', 'mountPath': LIGHT_DATADIR}]
+        spec['volumes'] = [{'name': 'geth-datadir', 'persistentVolumeClaim': {'claimName': 'geth-chaindata'}}]
+        if light.get('snapshot'):
+            # holds geth back until the snapshot is unpacked, unless the
+            # volume already has chaindata
+            spec['initContainers'] = [{
+                'name': 'seed',
+                'image': container['image'],
+                'command': ['sh', '-c', '[ -f {0}/.seeded ] || [ -d {0}/geth/lightchaindata ] || '
+                                        'until [ -f {0}/.seeded ]; do sleep 1; done'.format(LIGHT_DATADIR)],
+                'volumeMounts': container['volumeMounts'],
+            }]
+        return body
+
+    def running_pod(self):
+        api_instance = core_api()
+        while True:
+            pods = api_instance.list_namespaced_pod(self.name, label_selector='app=geth').items
+            pods = [p for p in pods if p.metadata.deletion_timestamp is None]
+            if pods:
+                return pods[0]
+            time.sleep(1)
+
+    def seed(self, snapshot):
+        """
+        Unpack a local snapshot archive into the chaindata volume while the
+        seed init container waits for it.
+        """
+        while True:
+            pod = self.running_pod()
+            if pod.status.init_container_statuses:
+                state = pod.status.init_container_statuses[0].state
+                if state.terminated is not None:
+                    logger.info('Volume already holds chaindata, not seeding')
+                    return
+                if state.running is not None:
+                    break
+            time.sleep(1)
+
+        start = time.time()
+        logger.info(f'Seeding {pod.metadata.name} from {snapshot}')
+        upload_archive(self.name, pod.metadata.name, snapshot, LIGHT_DATADIR,
+                       then='touch {}/.seeded'.format(LIGHT_DATADIR), container='seed')
+        logger.info(f'Seeded in {time.time() - start:.1f}s')
+
+    def wait_first_block(self, start, timeout):
+        """
+        Time from `start` until geth answers RPC and until it syncs its first
+        block past the height it started from.
+        """
+        from load import JsonRpc
+        pod = self.running_pod()
+        while pod.status.pod_ip is None:
+            time.sleep(1)
+            pod = self.running_pod()
+        rpc = JsonRpc('http://{}:8545'.format(pod.status.pod_ip), pool_size=1)
+
+        report = {'pod': pod.metadata.name, 'time': start}
+        deadline = start + timeout
+        while time.time() < deadline:
+            try:
+                height = int(rpc.call('eth_blockNumber'), 16)
+            except Exception:
+                time.sleep(1)
+                continue
+            if 'start_height' not in report:
+                report['rpc_up'] = round(time.time() - start, 3)
+                report['start_height'] = height
+            elif height > report['start_height']:
+                report['first_block'] = round(time.time() - start, 3)
+                report['first_block_height'] = height
+                break
+            time.sleep(1)
+        else:
+            logger.warning(f'No block synced within {timeout}s')
+        return report
+
+    def create_by_config(self, config_path):
+        """
+        Create the light client. With `light.storage` set in config.json its
+        chaindata lives on a retained volume (optionally seeded from
+        `light.snapshot`), otherwise in an emptyDir as with create().
+        """
+        with open(config_path) as f:
+            light = json.load(f).get("light", {})
+        if light.get('storage') and not light.get('node'):
+            # without it geth may land on a node that never saw the chaindata
+            print(config_path, "light.storage needs light.node, the node holding the volume")
+            return
+
+        start = time.time()
+        self.create_namespace()
+        self.create_service()
+        if light.get('storage'):
+            self.create_chaindata(light)
+            self.create_deployment(self.persistent_deployment_body(light))
+            if light.get('snapshot'):
+                self.seed(light['snapshot'])
+        else:
+            self.create_deployment()
+
+        report = self.wait_first_block(start, light.get('sync_timeout', 1800))
+        report['persistent'] = bool(light.get('storage'))
+        logger.info(f'RPC up after {report.get("rpc_up")}s at height {report.get("start_height")}, '
+                    f'first synced block after {report.get("first_block")}s')
+
+        # keep every run, so restarts with and without cached chaindata compare
+        path = "light_{}.json".format(self.name)
+        history = json.load(open(path)) if osp.exists(path) else []
+        history.append(report)
+        json.dump(history, open(path, "w"), indent=4)
+
+    def purge(self):
+        """
+        Wipe the retained chaindata volume and delete it with the namespace.
+        """
+        api_instance = core_api()
+        volumeName = self.chaindata_volume_name()
+        try:
+            api_instance.read_persistent_volume(volumeName)
+        except ApiException as e:
+            if e.status == 404:
+                return
+            raise
+
+        try:
+            apps_api().patch_namespaced_deployment_scale('geth', self.name, {'spec': {'replicas': 0}})
+        except ApiException as e:
+            if e.status != 404:
+                raise
+        # a claim is needed to reach the data, the namespace may be gone already
+        self.create_namespace()
+        self.create_chaindata({'storage': api_instance.read_persistent_volume(volumeName).spec.capacity['storage']})
+        with (self.k8s_config_dir / 'deployment.yaml').open() as f:
+            image = yaml.safe_load(f)['spec']['template']['spec']['containers'][0]['image']
+        body = {
+            'apiVersion': 'v1', 'kind': 'Pod',
+            'metadata': {'name': 'chaindata-purge'},
+            'spec': {
+                'restartPolicy': 'Never',
+                'containers': [{'name': 'purge', 'image': image,
+                                'command': ['sh', '-c', 'rm -rf {0}/* {0}/.seeded'.format(LIGHT_DATADIR)],
+                                'volumeMounts': [{'name': 'geth-datadir', 'mountPath': LIGHT_DATADIR}]}],
+                'volumes': [{'name': 'geth-datadir', 'persistentVolumeClaim': {'claimName': 'geth-chaindata'}}],
+            },
+        }
+        create_or_get(api_instance, 'pod', body, self.name)
+        while True:
+            phase = api_instance.read_namespaced_pod('chaindata-purge', self.name).status.phase
+            if phase == 'Succeeded':
+                break
+            if phase == 'Failed':
+                # keep the volume, its data is still there
+                raise RuntimeError('chaindata-purge pod failed, "{}" not purged, see `kubectl -n {} logs chaindata-purge`'
+                                   .format(volumeName, self.name))
+            time.sleep(1)
+        # deleted for good once the namespace releases the claim
+        api_instance.delete_persistent_volume(volumeName)
+        logger.info(f'Purged chaindata volume "{volumeName}"')
+
+    def delete(self):
+        # this will delete all objects under the namespace, but not the
+        # chaindata volume, see purge()
+        self.delete_namespace()
+
+
+class PrivateNetwork:
+    """
+    Private Ethereum Network (using geth)
+    """
+    def __init__(self, name):
+        self.name = name
+        self.namespace = name
+        self.accounts = []
+
+    def create_accounts(self, num=10):
+        from eth import create_eth_address
+        for i in range(num):
+            account = create_eth_address()
+            self.accounts.append(account)
+
+    def create_namespace(self):
+        path = pathlib.Path('k8s/namespace.yaml')
+        with path.open() as f:
+            body = yaml.safe_load(f)
+
+        body['metadata']['name'] = self.name
+
+        create_or_get(core_api(), 'namespace', body)
+
+        logger.debug(f'Created namespace "{self.name}"')
+
+    def delete_namespace(self):
+        v1 = core_api()
+        try:
+            v1.delete_namespace(name=self.name, body=client.V1DeleteOptions())
+        except ApiException as e:
+            if e.status == 404:
+                # don't throw if namespace doesn't exist
+                return
+            else:
+                raise
+        logger.debug(f'Deleted namespace "{self.name}"')
+
+    def create_configmap(self):
+        from eth import get_genesis_content
+        genesis = get_genesis_content(self.accounts)
+
+        path = pathlib.Path('k8s/configmap.yaml')
+        with path.open() as f:
+            body = yaml.safe_load(f)
+            body['data']['genesis.json'] = genesis
+
+        create_or_get(core_api(), 'config_map', body, self.namespace)
+
+        logger.debug('Created ConfigMap')
+
+    def create_secret(self, account):
+        path = pathlib.Path('k8s/secret.yaml')
+        with path.open() as f:
+            body = yaml.safe_load(f)
+
+        password = ''.join(random.choices(string.ascii_letters + string.digits,
+                                          k=10))
+
+        body['data']['address'] = encode(account['address'])
+        body['data']['private_key'] = encode(account['private_key'])
+        body['data']['password'] = encode(password)
+
+        create_or_get(core_api(), 'secret', body, self.namespace)
+
+        logger.debug('Created Secret')
+
+    def create_service(self):
+        path = pathlib.Path('k8s/service.yaml')
+        with path.open() as f:
+            body = yaml.safe_load(f)
+
+        create_or_get(core_api(), 'service', body, self.namespace)
+
+        logger.debug('Created Service')
+
+    def create_deployment(self):
+        path = pathlib.Path('k8s/deployment.yaml')
+        with path.open() as f:
+            body = yaml.safe_load(f)
+
+        create_or_get(apps_api(), 'deployment', body, self.namespace)
+
+        logger.debug('Created Deployment')
+    
+    def create_deployment_by_path(self, path):
+        path = pathlib.Path(path)
+        with path.open() as f:
+            body = yaml.safe_load(f)
+
+        create_or_get(apps_api(), 'deployment', body, self.namespace)
+
+        logger.debug('Created Deployment')
+
+    def deployment_body(self, path, replicas, resources=None):
+        path = pathlib.Path(path)
+        with path.open() as f:
+            body = yaml.safe_load(f)
+
+        body["spec"]["replicas"] = replicas
+        apply_resources(body["spec"]["template"]["spec"]["containers"][0], resources)
+        return body
+
+    def create_deployment_by_path_replicas(self, path, replicas, resources=None, body=None):
+        if body is None:
+            body = self.deployment_body(path, replicas, resources)
+
+        create_or_get(apps_api(), 'deployment', body, self.namespace)
+
+        logger.debug('Created Deployment')
+
+    def delete(self):
+        # this will delete all objects under the namespace
+        self.delete_namespace()
+
+    def get_node_ip_list(self):
+        nodeIpList = []
+        for node in core_api().list_node().items:
+            if not any(c.type == 'Ready' and c.status == 'True' for c in node.status.conditions or []):
+                continue
+            nodeIpList += [a.address for a in node.status.addresses if a.type == 'InternalIP']
+        print(nodeIpList)
+        return nodeIpList
+
+    def stage_binaries(self, config, nodeIpList):
+        """
+        Stage every pier/bitxhub build once per node under `<base>/bin-cache`.
+
+        Files are named after their content hash, so a node that already holds
+        a build is skipped and pods only ever mount the cached file read-only.
+        Returns a dict of config key (`pier`, `root_pier`, ...) -> host path.
+        """
+        cache_dir = osp.join(config["base"], "bin-cache")
+        staged = binary_cache_paths(config)
+
+        ssh = "sshpass -p {} ssh -o StrictHostKeyChecking=no {}@{}"
+        for nodeIp in nodeIpList:
+            probe = "for p in {}; do test -f $p || echo $p; done".format(" ".join(staged.values()))
+            cmd = probe if nodeIp == LOCAL_NODE_IP else '{} "{}"'.format(ssh.format(config["passwd"], config["user"], nodeIp), probe)
+            pipe = os.popen(cmd)
+            missing = pipe.read().split()
+            # an unreachable node would otherwise look like one holding every build
+            if pipe.close() is not None:
+                raise RuntimeError("checking {} on node {} failed".format(cache_dir, nodeIp))
+
+            for key, path in staged.items():
+                if path not in missing:
+                    continue
+                # copy to a temp name first so a pod never mounts a partial file
+                if nodeIp == LOCAL_NODE_IP:
+                    cmd = "mkdir -p {0} && cp {1} {2}.tmp && chmod 555 {2}.tmp && mv {2}.tmp {2}".format(cache_dir, config[key], path)
+                else:
+                    remote = ssh.format(config["passwd"], config["user"], nodeIp)
+                    cmd = '{0} "mkdir -p {1}" && sshpass -p {2} scp {3} {4}@{5}:{6}.tmp && {0} "chmod 555 {6}.tmp && mv {6}.tmp {6}"'.format(
+                        remote, cache_dir, config["passwd"], config[key], config["user"], nodeIp, path)
+                print(cmd)
+                code = os.system(cmd)
+                if code != 0:
+                    # pods on that node would hang on the missing hostPath file
+                    raise RuntimeError("staging {} on node {} exited with {}: {}".format(key, nodeIp, code >> 8, cmd))
+
+        return staged
+
+    def union_served(self, graph, i):
+        # the root union pier peers with every other relay chain
+        return len(graph) - 1 if i == 0 else 1
+
+    def resource_demands(self, config):
+        """
+        (pod name, resources) of every pod the topology in config needs.
+        """
+        graph = config["graph"]
+        demands = []
+        bitxhub_resources = self.bitxhub_resources(config)
+        for i, (p, chains) in enumerate(zip(graph, self.geth_layout(config))):
+            demands.append(("bitxhub-{}".format(i), bitxhub_resources))
+            for j, (_, ethName) in enumerate(chains):
+                demands.append((ethName, role_resources(config, "geth")))
+                demands.append(("pier-{}-{}".format(i, j), role_resources(config, "pier")))
+            if len(graph) > 1:
+                demands.append(("union-{}".format(i), role_resources(config, "union", self.union_served(graph, i))))
+        return demands
+
+    def geth_profile_name(self, config, i, j):
+        """
+        Geth profile of appchain j under bitxhub i: the graph entry's
+        `geth_profile` (one name, or a list with one per appchain), else the
+        top level `geth_profile`, else `dev`.
+        """
+        default = config.get("geth_profile", "dev")
+        profile = config["graph"][i].get("geth_profile", default)
+        if isinstance(profile, list):
+            return profile[j] if j < len(profile) else default
+        return profile
+
+    def geth_profile(self, config, name):
+        from eth import GETH_PROFILES, CLIQUE_DEFAULTS, merge_profile
+        # `geth_profiles` in config.json adds profiles or overrides keys of
+        # built-in ones, a new clique profile starts from the defaults
+        override = config.get("geth_profiles", {}).get(name)
+        if override is None:
+            profile = dict(GETH_PROFILES[name])
+        elif name in GETH_PROFILES:
+            profile = merge_profile(GETH_PROFILES[name], override)
+        else:
+            profile = merge_profile({} if override.get("dev") else CLIQUE_DEFAULTS, override)
+        if config.get("snapshot"):
+            # every block's state on disk rather than in memory, so a snapshot
+            # of the datadir keeps the latest state (see snapshot.py)
+            profile.setdefault("gcmode", "archive")
+        return profile
+
+    def geth_statefulset_name(self, profile_name):
+        return "geth" if profile_name == "dev" else "geth-{}".format(profile_name)
+
+    def geth_layout(self, config):
+        """
+        [(profile, pod name) of every appchain] per relay chain. Pods of a geth
+        StatefulSet are handed out in graph order, so which pod serves which
+        appchain is known before anything runs.
+        """
+        ordinals = {}
+        layout = []
+        for i, p in enumerate(config["graph"]):
+            chains = []
+            for j in range(p["eth"]):
+                profile = self.geth_profile_name(config, i, j)
+                name = self.geth_statefulset_name(profile)
+                ordinals[name] = ordinals.get(name, -1) + 1
+                chains.append((profile, "{}-{}".format(name, ordinals[name])))
+            layout.append(chains)
+        return layout
+
+    def headless_service_body(self, statefulSetName, labels):
+        path = pathlib.Path('k8s/service-headless.yaml')
+        with path.open() as f:
+            body = yaml.safe_load(f)
+
+        body['metadata']['name'] = "{}-headless".format(statefulSetName)
+        body['spec']['selector'] = dict(labels)
+        return body
+
+    def bitxhub_host(self, i):
+        return "bitxhub-{}.bitxhub-headless".format(i)
+
+    def geth_host(self, podName):
+        # pods of StatefulSet "geth-x" are named "geth-x-<ordinal>"
+        return "{}.{}-headless".format(podName, podName.rsplit('-', 1)[0])
+
+    def geth_bodies(self, config):
+        """
+        Secret, headless Service and StatefulSet bodies of the appchain geths,
+        one StatefulSet per geth profile in use. Every pod of a profile is its
+        own chain.
+        """
+        from eth import create_eth_address, get_genesis_content, geth_command, GODUCK_ACCOUNT, GENESIS_DIR, GETH_DATADIR
+        counts = {}
+        for chains in self.geth_layout(config):
+            for name, _ in chains:
+                counts[name] = counts.get(name, 0) + 1
+
+        bodies = {}
+        for name, replicas in counts.items():
+            profile = self.geth_profile(config, name)
+            statefulSetName = self.geth_statefulset_name(name)
+            body = self.deployment_body('k8s/statefulset-ether.yaml', replicas, role_resources(config, "geth"))
+            self.size_state_volume(config, body, "geth")
+            body['metadata']['name'] = statefulSetName
+            body['spec']['serviceName'] = "{}-headless".format(statefulSetName)
+            body['spec']['selector']['matchLabels']['profile'] = name
+            body['spec']['template']['metadata']['labels']['profile'] = name
+            bodies["{}-headless".format(statefulSetName)] = self.headless_service_body(
+                statefulSetName, body['spec']['selector']['matchLabels'])
+            if profile.get("dev"):
+                if profile.get("gcmode"):
+                    body['spec']['template']['spec']['containers'][0]['args'] += ['--gcmode', profile["gcmode"]]
+                bodies[statefulSetName] = body
+                continue
+
+            signer = create_eth_address()
+            password = ''.join(random.choices(string.ascii_letters + string.digits, k=10))
+            with pathlib.Path('k8s/secret.yaml').open() as f:
+                secret = yaml.safe_load(f)
+            secret['metadata']['name'] = statefulSetName
+            secret['data'] = {
+                'genesis.json': encode(get_genesis_content([signer], profile, [GODUCK_ACCOUNT])),
+                'signer.key': encode(signer['private_key']),
+                'password': encode(password),
+            }
+            bodies["{}-secret".format(statefulSetName)] = secret
+
+            spec = body['spec']['template']['spec']
+            spec['containers'][0]['command'] = ['sh', '-c']
+            spec['containers'][0]['args'] = [geth_command(profile, signer['address'])]
+            spec['containers'][0]['volumeMounts'] = [{'name': 'geth-data', 'mountPath': GETH_DATADIR},
+                                                     {'name': 'genesis', 'mountPath': GENESIS_DIR, 'readOnly': True}]
+            spec['volumes'] = [{'name': 'genesis', 'secret': {'secretName': statefulSetName}}]
+            bodies[statefulSetName] = body
+        return bodies
+
+    def create_bodies(self, bodies):
+        for name, body in bodies.items():
+            if body['kind'] == 'Secret':
+                create_or_get(core_api(), 'secret', body, self.namespace)
+            elif body['kind'] == 'Service':
+                create_or_get(core_api(), 'service', body, self.namespace)
+            elif body['kind'] == 'StatefulSet':
+                create_or_get(apps_api(), 'stateful_set', body, self.namespace)
+            else:
+                self.create_deployment_by_path_replicas(None, None, body=body)
+            logger.debug(f'Created {body["kind"]} {name}')
+
+    def size_state_volume(self, config, body, role):
+        """
+        Apply `state_storage` of config.json (size per role, storage class)
+        to the per-pod volume of a StatefulSet.
+        """
+        storage = config.get("state_storage", {})
+        claim = body['spec']['volumeClaimTemplates'][0]['spec']
+        if role in storage:
+            claim['resources']['requests']['storage'] = storage[role]
+        if storage.get("class"):
+            claim['storageClassName'] = storage["class"]
+
+    def bitxhub_id(self, i):
+        # bitxhub-<i> runs `cluster.sh 123<i>`, see k8s/statefulset-bitxhub.yaml
+        return '123{}'.format(i)
+
+    def bitxhub_resources(self, config):
+        # the pods of one StatefulSet share a template, size them for the
+        # relay chain serving the most appchains
+        return role_resources(config, "bitxhub", max(p["eth"] for p in config["graph"]))
+
+    def bitxhub_bodies(self, config, staged):
+        """
+        Headless Service and StatefulSet bodies of the relay chains, pod
+        bitxhub-<i> runs relay chain i.
+        """
+        body = self.deployment_body('k8s/statefulset-bitxhub.yaml', len(config["graph"]), self.bitxhub_resources(config))
+        self.size_state_volume(config, body, "bitxhub")
+        set_volume_path(body['spec']['template'], 'bitxhub-bin', staged["bitxhub"])
+        root = binary_variant(config, "bitxhub", 0)
+        if root != "bitxhub":
+            spec = body['spec']['template']['spec']
+            spec['containers'][0]['volumeMounts'].append(
+                {'name': 'root-bitxhub-bin', 'mountPath': '/opt/bin/root_bitxhub', 'readOnly': True})
+            spec['volumes'].append({'name': 'root-bitxhub-bin', 'hostPath': {'path': staged[root], 'type': 'File'}})
+        return {
+            'bitxhub-headless': self.headless_service_body('bitxhub', body['spec']['selector']['matchLabels']),
+            'bitxhub': body,
+        }
+
+    def pier_pod_body(self, config, i, j, mount_pier, staged):
+        path = pathlib.Path('k8s/deployment-pier.yaml')
+        with path.open() as f:
+            body = yaml.safe_load(f)
+
+        body['metadata']['name'] = "pier-{}-{}".format(i, j)
+
+        body['spec']['containers'][0]['volumeMounts'][0]['name'] = "pier-{}-{}".format(i, j)
+        body['spec']['containers'][0]['volumeMounts'][0]['mountPath'] = "/root/.pier"
+        body['spec']['volumes'][0]['name'] = "pier-{}-{}".format(i, j)
+        body['spec']['volumes'][0]['hostPath']['path'] = mount_pier
+        body['spec']['volumes'][0]['hostPath']['type'] = "Directory"
+        set_volume_path(body, 'bitxhub-bin', staged["bitxhub"])
+        apply_resources(body['spec']['containers'][0], role_resources(config, "pier"))
+
+        body['spec']['containers'][0]['name'] = "pier-0-{}".format(j)
+        return body
+
+    def union_pod_body(self, config, i, mount_union_pier, staged):
+        path = pathlib.Path('k8s/deployment-union-pier.yaml')
+        with path.open() as f:
+            body = yaml.safe_load(f)
+
+        body['metadata']['name'] = "union-{}".format(i)
+
+        body['spec']['containers'][0]['volumeMounts'][0]['name'] = "union-{}".format(i)
+        body['spec']['volumes'][0]['name'] = "union-{}".format(i)
+        body['spec']['volumes'][0]['hostPath']['path'] = mount_union_pier
+        body['spec']['volumes'][0]['hostPath']['type'] = "Directory"
+        set_volume_path(body, 'pier-bin', staged[binary_variant(config, "pier", i)])
+        set_volume_path(body, 'bitxhub-bin', staged[binary_variant(config, "bitxhub", i)])
+        apply_resources(body['spec']['containers'][0],
+                        role_resources(config, "union", self.union_served(config["graph"], i)))
+
+        body['spec']['containers'][0]['name'] = "union-{}".format(i)
+        return body
+
+    def init_pier_repo(self, config, mount_pier, bitxhubHost, ethHost, appchain_id, broker):
+        import toml
+        cmd = "rm -rf {}".format(mount_pier)
+        os.system(cmd)
+        cmd = "mkdir -p {} && {} --repo={} init relay".format(mount_pier, config['pier'], mount_pier)
+        code = os.system(cmd)
+        if code != 0:
+            raise RuntimeError("`{}` exited with {}".format(cmd, code >> 8))
+        cmd = "cp -r {} {} && cp -r {} {}".format(config['plugins'], osp.join(mount_pier, 'plugins'), config['ether'], osp.join(mount_pier, 'ether'))
+        code = os.system(cmd)
+        if code != 0:
+            raise RuntimeError("copying plugins and ether config into {} exited with {}".format(mount_pier, code >> 8))
+        addrs = [bitxhubHost + ':6001{}'.format(i) for i in range(1, 5)]
+        pier_toml = toml.load(osp.join(mount_pier, "pier.toml"))
+        pier_toml['mode']['relay']['addrs'] = addrs
+        pier_toml['mode']['relay']['timeout_limit'] = "10s"
+        pier_toml['mode']['union']['addrs'] = addrs
+        pier_toml['appchain']['id'] = appchain_id
+        pier_toml['appchain']['plugin'] = "eth-client"
+        pier_toml['appchain']['config'] = "ether"
+        # print(toml.dumps(pier_toml))
+        toml.dump(pier_toml, open(osp.join(mount_pier, "pier.toml"), "w"))
+
+        ethereum_toml = toml.load(osp.join(mount_pier, "ether/ethereum.toml"))
+        ethereum_toml['ether']['addr'] = "ws://{}:8546".format(ethHost)
+        ethereum_toml['ether']['contract_address'] = broker
+        toml.dump(ethereum_toml, open(osp.join(mount_pier, "ether/ethereum.toml"), "w"))
+
+    def init_union_repo(self, config, i, mount_union_pier, bitxhubHost):
+        """
+        Initialise a union pier repo and return its p2p id.
+        """
+        import toml
+        cmd = "rm -rf {}".format(mount_union_pier)
+        os.system(cmd)
+
+        pier_path = config[binary_variant(config, "pier", i)]
+
+        cmd = "mkdir -p {} && {} --repo={} init union --addPier 127.0.0.1:4343#fjksdd".format(mount_union_pier, pier_path, mount_union_pier)
+        os.system(cmd)
+        cmd = "{} --repo={} p2p id".format(pier_path, mount_union_pier)
+        unionPierId = os.popen(cmd).read()
+
+        addrs = [bitxhubHost + ':6001{}'.format(i) for i in range(1, 5)]
+        pier_toml = toml.load(osp.join(mount_union_pier, "pier.toml"))
+        pier_toml['mode']['relay']['addrs'] = addrs
+        pier_toml['mode']['relay']['timeout_limit'] = "10s"
+        pier_toml['mode']['union']['addrs'] = addrs
+        print(toml.dumps(pier_toml))
+        toml.dump(pier_toml, open(osp.join(mount_union_pier, "pier.toml"), "w"))
+        return unionPierId.strip()
+
+    def write_union_network(self, union_json, repo_of):
+        """
+        Point every union pier's network.toml at the root union pier and the
+        root at all others. repo_of(i) is the repo directory of union-i.
+        """
+        import toml
+        rootPierIp = union_json["union-0"]["union_pier_ip"]
+        rootUnionPort = union_json["union-0"]["union_pier_port"]
+        root_mount_union_pier = repo_of(0)
+        root_pier_toml = toml.load(osp.join(root_mount_union_pier, "network.toml"))
+        root_hosts = ["/ip4/{}/tcp/{}/p2p/".format(rootPierIp, rootUnionPort)]
+        root_pier_toml['piers'][0]['hosts'] = root_hosts
+        root_pier_toml['piers'][0]['pid'] = union_json["union-0"]["union_pier_p2p_id"]
+        root_struct = {"hosts": root_hosts, "pid": union_json["union-0"]["union_pier_p2p_id"]}
+
+        for i, (unionName, item) in enumerate(union_json.items()):
+            if i == 0:
+                continue
+            unionPort = item["union_pier_port"]
+            unionP2pId = item["union_pier_p2p_id"]
+            unionIp = item["union_pier_ip"]
+            
+            mount_union_pier = repo_of(i)
+            pier_toml = toml.load(osp.join(mount_union_pier, "network.toml"))
+            
+            hosts = ["/ip4/{}/tcp/{}/p2p/".format(unionIp, unionPort)]
+            pier_toml['piers'][0]['hosts'] = hosts
+            pier_toml['piers'][0]['pid'] = unionP2pId
+            pier_toml['piers'].append(root_struct)
+
+            toml.dump(pier_toml, open(osp.join(mount_union_pier, "network.toml"), "w"))
+
+            root_pier_toml['piers'].append(
+                pier_toml['piers'][0]
+            )
+        toml.dump(root_pier_toml, open(osp.join(root_mount_union_pier, "network.toml"), "w"))
+
+    def register_commands(self, pierName, item, pierId, broker, transfer):
+        """
+        (pod, command) pairs registering a relay pier's appchain and service.
+        """
+        bitxhubName = item['bitxhubName']
+        cmds = []
+        # 中继链转账
+        cmd = "bitxhub client transfer --key /root/bitxhub/scripts/build/node1/key.json --to {} --amount 100000000000000000".format(pierId)
+        cmds.append((bitxhubName, cmd))
+
+        cmd = 'pier --repo /root/.pier appchain register --appchain-id "{}" --name "{}"' \
+              ' --type "{}" --trustroot /root/.pier/ether/ether.validators --broker' \
+              ' {} --desc "desc" --master-rule "0x00000000000000000000000000000000000000a2"'\
+              ' --rule-url "http://github.com" --admin {}'\
+              ' --reason "reason"'.format(
+                    item['appchain_id'], 
+                    item['appchain_name'], 
+                    item['appchain_type'],
+                    broker,
+                    pierId
+                    )
+        cmds.append((pierName, cmd))
+
+        for nodeId in range(1, 4):
+            cmd = 'bitxhub --repo /root/bitxhub/scripts/build/node{} client governance vote --id {}-0 --info approve --reason approve'.format(nodeId, pierId)
+            cmds.append((bitxhubName, cmd))
+        
+        cmd = 'pier --repo /root/.pier appchain service register --appchain-id "{}"' \
+              ' --service-id "{}" --name "{}"'\
+              ' --intro "" --type CallContract --permit "" --details "test"--reason "reason"'.format(
+                    item['appchain_id'], 
+                    transfer,
+                    "service-{}".format(pierName)
+              )
+        cmds.append((pierName, cmd))
+
+        for nodeId in range(1, 4):
+            cmd = 'bitxhub --repo /root/bitxhub/scripts/build/node{} client governance vote --id {}-1 --info approve --reason approve'.format(nodeId, pierId)
+            cmds.append((bitxhubName, cmd))
+        return cmds
+
+    def union_register_commands(self, union_json, i, pierId):
+        """
+        (pod, command) pairs registering union-i with its relay chain.
+        """
+        unionName = "union-{}".format(i)
+        bitxhubName = union_json[unionName]["bitxhubName"]
+        rootBitxhubId = union_json["union-0"]["bitxhubId"]
+        rootAppchainName = "bitxhub_{}".format(rootBitxhubId)
+        cmds = []
+
+        # 中继链转账
+        cmd = "bitxhub client transfer --key /root/bitxhub/scripts/build/node1/key.json --to {} --amount 100000000000000000".format(pierId)
+        cmds.append((bitxhubName, cmd))
+
+        if i != 0:
+            cmd = 'pier --repo /root/.pier appchain register --appchain-id "{}" --name "{}"' \
+                ' --type "{}" --trustroot /root/.pier/union.validators ' \
+                ' --broker "0x0000000000000000000000000000000000000019"' \
+                ' --desc "desc" --master-rule "0x00000000000000000000000000000000000000a2"'\
+                ' --rule-url "http://github.com" --admin {}'\
+                ' --reason "reason"'.format(
+                        rootBitxhubId, 
+                        rootAppchainName, 
+                        "relaychain",
+                        pierId
+                        )
+            cmds.append((unionName, cmd))
+
+            for nodeId in range(1, 4):
+                cmd = 'bitxhub --repo /root/bitxhub/scripts/build/node{} client governance vote --id {}-0 --info approve --reason approve'.format(nodeId, pierId)
+                cmds.append((bitxhubName, cmd))
+
+        else:
+            for j in range(1, len(union_json.items())):
+                bitxhubId = union_json["union-{}".format(j)]["bitxhubId"]
+                appchainName = "bitxhub_{}".format(bitxhubId)
+                cmd = 'pier --repo /root/.pier appchain register --appchain-id "{}" --name "{}"' \
+                        ' --type "{}" --trustroot /root/.pier/union.validators ' \
+                        ' --broker "0x0000000000000000000000000000000000000019"' \
+                        ' --desc "desc" --master-rule "0x00000000000000000000000000000000000000a2"'\
+                        ' --rule-url "http://github.com" --admin {}'\
+                        ' --reason "reason"'.format(
+                            bitxhubId, 
+                            appchainName, 
+                            "relaychain",
+                            pierId
+                            )
+                cmds.append((unionName, cmd))
+
+                for nodeId in range(1, 4):
+                    cmd = 'bitxhub --repo /root/bitxhub/scripts/build/node{} client governance vote --id {}-{} --info approve --reason approve'.format(nodeId, pierId, j-1)
+                    cmds.append((bitxhubName, cmd))
+        return cmds
+
+    def exec_cmd(self, podName, cmd):
+        # through the rate limited client, not one kubectl process per command
+        print("\t", podName, cmd)
+        ok, out, err = exec_script(self.namespace, podName, cmd)
+        if not ok:
+            logger.warning(f'{podName}: `{cmd}` failed: {err.strip()}')
+        return out
+
+    def pier_address(self, podName):
+        # the relay chain id of a pier is the address of its key
+        out = self.exec_cmd(podName, "bitxhub key show --path /root/.pier/key.json")
+        return [line for line in out.splitlines() if 'address' in line][-1].split()[-1]
+
+    def clear_namespace(self):
+        """
+        Ask to delete the namespace if it exists and wait until it is gone.
+        Returns False when the user keeps it.
+        """
+        def exists():
+            try:
+                core_api().read_namespace(self.namespace)
+                return True
+            except ApiException as e:
+                if e.status == 404:
+                    return False
+                raise
+
+        if exists():
+            deleteFlag = input("namespace {} already exists, delete? y/n：".format(self.namespace))
+            if deleteFlag != "y" and deleteFlag != "yes":
+                return False
+            self.delete_namespace()
+            while exists():
+                print("waiting ...")
+                time.sleep(1)
+        return True
+
+    def create_by_config(self, config_path):
+        config = None
+        with open(config_path) as f:
+            config = json.load(f)
+        if config is None:
+            print(config_path, "open failed")
+            return
+        configure_api(config)
+
+        # refuse before anything is deleted, the old network's pods make way
+        if config.get("resources"):
+            problems = check_capacity(self.resource_demands(config), replacing=self.namespace)
+            if problems:
+                for problem in problems:
+                    logger.error(problem)
+                print("not enough cluster capacity for", config_path)
+                return
+
+        if not self.clear_namespace():
+            return
+
+        self.create_namespace()
+        self.create_service()
+
+        nodeIpList = self.get_node_ip_list()
+
+        staged = self.stage_binaries(config, nodeIpList)
+        plan = load_plan(self.namespace, config, staged)
+
+        if plan:
+            self.create_bodies({name: plan_manifest(plan, name) for name in plan['geth'] + plan['bitxhub']})
+        else:
+            self.create_bodies(self.geth_bodies(config))
+            self.create_bodies(self.bitxhub_bodies(config, staged))
+
+        # pods are reached by their stable DNS name, nothing to wait for here
+        d = {}
+        for i, chains in enumerate(self.geth_layout(config)):
+            names = [ethName for _, ethName in chains]
+            d['bitxhub-{}'.format(i)] = {
+                'bitxhubId': self.bitxhub_id(i),
+                'bitxhubHost': self.bitxhub_host(i),
+                'chainNameList': names,
+                'chainHostList': [self.geth_host(ethName) for ethName in names],
+                'chainProfileList': [profile for profile, _ in chains],
+                'pierPrefixName': "pier-{}".format(i),
+            }
+
+        json.dump(d, open("graph_{}.json".format(self.namespace), "w"), indent=4)
+
+
+
+    def create(self):
+        # self.create_accounts()
+        # # print address and private key
+        # for account in self.accounts:
+        #     print('Address:', account['address'],
+        #           'Private Key:', account['private_key'])
+        self.create_namespace()
+        # self.create_secret(self.accounts[0])
+        # self.create_configmap()
+        self.create_service()
+        # self.create_deployment()
+        self.create_deployment_by_path('k8s/deployment-ether.yaml')
+        self.create_deployment_by_path('k8s/deployment-bitxhub.yaml')
+        # self.create_deployment_by_path('k8s/deployment-pier.yaml')
+
+
+    def deploy(self):
+        # ethInfo = os.popen("kubectl get pods -n {} -o wide | grep geth".format(self.namespace)).read()
+        # ethIpList = [ethItem.split()[-4] for ethItem in ethInfo.split('\n') if ethItem != '']
+
+        # connect bitxhubId with ethereum when deploy broker contract
+        d = {}
+        graph_json = None
+        with open("graph_{}.json".format(self.namespace)) as f:
+            graph_json = json.load(f)
+
+        # goduck runs outside the cluster, it needs the pod ips
+        ethIps = pod_ips(self.namespace, [name for item in graph_json.values() for name in item["chainNameList"]], wait=True)
+
+        appchainId = 0
+        for bitxhubName, item in graph_json.items():
+            bitxhubId = item["bitxhubId"]
+            for ethName, ethHost in zip(item["chainNameList"], item["chainHostList"]):
+                ethIp = ethIps[ethName]
+                print("handle geth: ", ethName, ethIp)
+                print("handle bitxhub_id: ", bitxhubId)
+                cmd = 'goduck ether contract deploy --code-path $HOME/goduck/scripts/example/broker.sol --address http://{}:8545  "{}^ethappchain{}^["0xc7F999b83Af6DF9e67d0a37Ee7e900bF38b3D013","0x79a1215469FaB6f9c63c1816b45183AD3624bE34","0x97c8B516D19edBf575D72a172Af7F418BE498C37","0xc0Ff2e0b3189132D815b8eb325bE17285AC898f8"]^1^["0x20F7Fac801C5Fc3f7E20cFbADaA1CDb33d818Fa3"]^1"| grep 0x'.format(ethIp, bitxhubId, appchainId)
+                broker_addr = os.popen(cmd).read()
+                if broker_addr == "":
+                    print(cmd)
+                    print(os.popen(cmd).read())
+                    print("error command")
+                    return
+                broker_addr = broker_addr.split()[-1]
+                print("\tbroker addr:", broker_addr)
+
+                cmd = 'goduck ether contract deploy --address http://{}:8545  --code-path $HOME/goduck/scripts/example/transfer.sol {}| grep 0x'.format(ethIp, broker_addr)
+                transfer_addr = os.popen(cmd).read().split()[-1]
+                print("\ttransfer addr:", transfer_addr)
+
+                cmd = 'goduck ether contract invoke --key-path $HOME/goduck/scripts/docker/quick_start/account.key --abi-path $HOME/goduck/scripts/example/broker.abi --address http://{}:8545 {} audit "{}^1"'.format(ethIp, broker_addr, transfer_addr)
+                os.popen(cmd).read()
+                print("\t合约审计成功")
+
+                d[ethName] = {"broker": broker_addr, "transfer": transfer_addr, "id": "ethappchain{}".format(appchainId),
+                              "bitxhub_id": bitxhubId, "host": ethHost}
+                appchainId += 1
+
+        json.dump(d, open("deploy_{}.json".format(self.namespace), "w"), indent=4)
+
+
+    def create_deployment_pier(self, pier, failed=False):
+        """
+        Create the relay pier of every appchain: init (or render) its repo,
+        copy it to every node, create its pod. Piers are provisioned
+        concurrently by `pier_workers` workers, progress and failures go to
+        pier_status_<name>.json; with `failed`, only the piers that did not
+        finish last time are provisioned again.
+        """
+        config = None
+        with open(pier) as f:
+            config = json.load(f)
+
+        if config is None:
+            print(pier, "open failed")
+            return
+        configure_api(config)
+        
+        # bitxhubInfo = os.popen("kubectl get pods -n {} -o wide | grep bitxhub".format(self.namespace)).read()
+        # bitxhubIpList = [bitxhubItem.split()[-4] for bitxhubItem in bitxhubInfo.split('\n') if bitxhubItem != '']
+        # bitxhubNameList = [bitxhubItem.split()[0] for bitxhubItem in bitxhubInfo.split('\n') if bitxhubItem != '']
+        # print(bitxhubIpList)
+        # print(bitxhubNameList)
+
+        # ethInfo = os.popen("kubectl get pods -n {} -o wide | grep geth".format(self.namespace)).read()
+        # ethIpList = [ethItem.split()[-4] for ethItem in ethInfo.split('\n') if ethItem != '']
+        # ethNameList = [ethItem.split()[0] for ethItem in ethInfo.split('\n') if ethItem != '']
+        # print(ethIpList)
+        # print(ethNameList)
+
+        nodeIpList = self.get_node_ip_list()
+        staged = self.stage_binaries(config, nodeIpList)
+        plan = load_plan(self.namespace, config, staged)
+        values = late_values(self.namespace)
+
+        pier_json = {}
+        # graph_json = None
+        # with open("graph_{}".format(self.namespace)) as f:
+        #     graph_json = json.load(f)
+        # graph = config["graph"]
+        # for i in range(len(graph)):
+        #     subGraph = graph[i]
+        #     ethNum = subGraph["eth"]
+        #     bitxhubIp = bitxhubIpList.pop()
+        #     bitxhubName = bitxhubNameList.pop()
+        #     ethIps = []
+        #     ethNames = []
+        #     for j in range(ethNum):
+        #         ethIps.append(ethIpList.pop())
+        #         ethNames.append(ethNameList.pop())
+        #     graph_json[bitxhubName]["chainNameList"] = ethNames.copy()
+        #     graph_json[bitxhubName]["chainIpList"] = ethIps.copy()
+        #     graph_json[bitxhubName]["pierPrefixName"] = "pier-{}".format(i)
+        #     # graph_json[bitxhubName] = {
+        #     #     "chainNameList": ethNames.copy(),
+        #     #     "chainIpList": ethIps.copy(),
+        #     #     "pierPrefixName": "pier-{}".format(i)
+        #     # }
+
+        graph_json = None
+        with open("graph_{}.json".format(self.namespace)) as f:
+            graph_json = json.load(f)
+        deploy_json = json.load(open("deploy_{}.json".format(self.namespace)))
+
+        statusPath = "pier_status_{}.json".format(self.namespace)
+        status = {}
+        if failed:
+            # rerun only what did not finish last time, keep the rest
+            if not osp.exists(statusPath):
+                logger.error(f'{statusPath} not found, nothing to rerun: provision with --pier {pier} first')
+                return
+            with open(statusPath) as f:
+                status = json.load(f)
+            if osp.exists("pier_{}.json".format(self.namespace)):
+                with open("pier_{}.json".format(self.namespace)) as f:
+                    pier_json = json.load(f)
+
+        piers = []
+        for i, (bitxhubName, item) in enumerate(graph_json.items()):
+            for j in range(len(item["chainNameList"])):
+                pierName = "pier-{}-{}".format(i, j)
+                if failed and status.get(pierName, {}).get("state") == "done":
+                    continue
+                piers.append((i, j, pierName, bitxhubName, item))
+        if not piers:
+            logger.info(f'No failed piers in {statusPath}, nothing to do')
+            return
+
+        lock = threading.Lock()
+
+        def progress(pierName, state, step, error=None):
+            with lock:
+                status[pierName] = {"state": state, "step": step, "time": round(time.time(), 1)}
+                if error is not None:
+                    status[pierName]["error"] = error
+                done = sum(1 for p in piers if status.get(p[2], {}).get("state") == "done")
+                # written on every step so an interrupted run can be resumed with --failed
+                json.dump(status, open(statusPath, "w"), indent=4)
+            logger.info(f'[{done}/{len(piers)}] {pierName}: {step} {state}' + (f' ({error})' if error else ''))
+
+        def provision(i, j, pierName, bitxhubName, item):
+            """ init -> copy to every node -> pod, in order for one pier """
+            ethName = item["chainNameList"][j]
+            ethHost = item["chainHostList"][j]
+            mount_pier = osp.join(config["base"], "mount_pier{}{}".format(i, j))
+
+            progress(pierName, "running", "init")
+            if plan:
+                render_repo(plan_repo(plan, osp.basename(mount_pier)), mount_pier, values)
+            else:
+                self.init_pier_repo(config, mount_pier, item["bitxhubHost"], ethHost,
+                                    deploy_json[ethName]["id"], deploy_json[ethName]['broker'])
+
+            progress(pierName, "running", "copy")
+            for nodeIp in nodeIpList:
+                if nodeIp == LOCAL_NODE_IP:
+                    continue
+                cmd = "sshpass -p {} scp -r {} {}@{}:{}".format(config["passwd"], mount_pier, config["user"], nodeIp, config["base"])
+                if os.system(cmd) != 0:
+                    raise RuntimeError("copy to {} failed".format(nodeIp))
+
+            progress(pierName, "running", "pod")
+            if plan:
+                body = plan_manifest(plan, pierName)
+            else:
+                body = self.pier_pod_body(config, i, j, mount_pier, staged)
+            create_or_get(core_api(), 'pod', body, self.namespace)
+
+            return {
+                "bitxhubName": bitxhubName,
+                "appchain_id": deploy_json[ethName]["id"],
+                "appchain_name": "eth{}{}".format(i, j),
+                "appchain_type": "ETH",
+                "appchain_geth": ethName,
+            }
+
+        # piers do not depend on each other, every one runs its steps in its own worker
+        with ThreadPoolExecutor(max_workers=min(config.get("pier_workers", 16), len(piers))) as pool:
+            futures = {pool.submit(provision, *p): p[2] for p in piers}
+            for future in as_completed(futures):
+                pierName = futures[future]
+                try:
+                    pier_json[pierName] = future.result()
+                except Exception as e:
+                    progress(pierName, "failed", status[pierName]["step"], "{}: {}".format(type(e).__name__, e))
+                    continue
+                progress(pierName, "done", "pod")
+
+        # keep graph order, the same as a sequential run
+        pier_json = {name: pier_json[name] for name in sorted(pier_json, key=lambda n: [int(x) for x in n.split('-')[1:]])}
+        json.dump(pier_json, open("pier_{}.json".format(self.namespace), "w"), indent=4)
+
+        failures = [name for name in status if status[name]["state"] == "failed"]
+        if failures:
+            logger.error(f'{len(failures)} of {len(piers)} piers failed: {", ".join(failures)}, '
+                         f'see {statusPath} and rerun with --pier {pier} --failed')
+
+    def register(self, configPath):
+        config = None
+        with open(configPath) as f:
+            config = json.load(f)
+        if config is None:
+            print(configPath, "open failed")
+            return
+
+        pier = None
+        with open("pier_{}.json".format(self.namespace)) as f:
+            pier = json.load(f)
+        if pier is None:
+            print("pier_{}.json".format(self.namespace), "open failed")
+            return
+        
+        deploy = None
+        with open("deploy_{}.json".format(self.namespace)) as f:
+            deploy = json.load(f)
+        if deploy is None:
+            print("deploy_{}.json".format(self.namespace), "open failed")
+            return
+
+        plan = load_plan(self.namespace, config)
+        if plan:
+            # pier addresses were read from the planned repos already
+            for podName, cmd in render(plan['commands']['register'], late_values(self.namespace)):
+                print("\t", self.exec_cmd(podName, cmd))
+            return
+
+        pierNameList = [pod.metadata.name for pod in core_api().list_namespaced_pod(self.namespace).items
+                        if pod.metadata.name.startswith('pier-')]
+
+        for pierName in pierNameList:
+            print("handle pier", pierName)
+            # bitxhub is mounted read-only from the node's bin-cache, see stage_binaries
+            pierId = self.pier_address(pierName)
+
+            appchain = deploy[pier[pierName]['appchain_geth']]
+            for podName, cmd in self.register_commands(pierName, pier[pierName], pierId,
+                                                       appchain['broker'], appchain['transfer']):
+                print("\t", self.exec_cmd(podName, cmd))
+
+    def create_deployment_union_pier(self, pier):
+        config = None
+        with open(pier) as f:
+            config = json.load(f)
+
+        if config is None:
+            print(pier, "open failed")
+            return
+        configure_api(config)
+
+        nodeIpList = self.get_node_ip_list()
+        staged = self.stage_binaries(config, nodeIpList)
+        plan = load_plan(self.namespace, config, staged)
+        values = late_values(self.namespace)
+
+        union_pier_json = {}
+        graph_json = None
+        with open("graph_{}.json".format(self.namespace)) as f:
+            graph_json = json.load(f)
+
+        for i, (bitxhubName, item) in enumerate(graph_json.items()):
+            bitxhubHost = item["bitxhubHost"]
+            bitxhubId = item["bitxhubId"]
+            
+            mount_union_pier = osp.join(config["base"], "mount_union_pier{}".format(i))
+            if plan:
+                render_repo(plan_repo(plan, osp.basename(mount_union_pier)), mount_union_pier, values)
+                unionPierId = plan['unions']["union-{}".format(i)]["union_pier_p2p_id"]
+            else:
+                unionPierId = self.init_union_repo(config, i, mount_union_pier, bitxhubHost)
+
+            for nodeIp in nodeIpList:
+                if nodeIp == LOCAL_NODE_IP:
+                    continue
+                cmd = "sshpass -p {} scp -r {} {}@{}:{}".format(config["passwd"], mount_union_pier, config["user"], nodeIp, config["base"])
+                print(cmd)
+                os.system(cmd)
+
+            if plan:
+                body = plan_manifest(plan, "union-{}".format(i))
+            else:
+                body = self.union_pod_body(config, i, mount_union_pier, staged)
+
+            create_or_get(core_api(), 'pod', body, self.namespace)
+
+            union_pier_json["union-{}".format(i)] = {
+                "bitxhubName": bitxhubName, 
+                "bitxhubHost": bitxhubHost, 
+                "bitxhubId": bitxhubId,
+                #"union_pier_ip": unionPierIpList[i],
+                "union_pier_port": "4343",
+                "union_pier_p2p_id":unionPierId,
+            }
+        ips = pod_ips(self.namespace, list(union_pier_json), wait=True)
+        for unionName, item in union_pier_json.items():
+            item["union_pier_ip"] = ips[unionName]
+
+        json.dump(union_pier_json, open("union_{}.json".format(self.namespace), "w"), indent=4)
+
+    def create_deployment_union_network_config(self, pier):
+        config = None
+        with open(pier) as f:
+            config = json.load(f)
+
+        if config is None:
+            print(pier, "open failed")
+            return
+        configure_api(config)
+
+        union_json = None
+        with open("union_{}.json".format(self.namespace)) as f:
+            union_json = json.load(f)
+
+        repo_of = lambda i: osp.join(config["base"], "mount_union_pier{}".format(i))
+        plan = load_plan(self.namespace, config)
+        if plan:
+            # network.toml is planned already, only the union pier ips are missing
+            values = late_values(self.namespace)
+            for i in range(len(union_json)):
+                src = osp.join(plan_repo(plan, "mount_union_pier{}".format(i)), "network.toml")
+                render_file(src, osp.join(repo_of(i), "network.toml"), values)
+            return
+
+        self.write_union_network(union_json, repo_of)
+
+    def create_deployment_union_start(self, pier):
+        config = None
+        with open(pier) as f:
+            config = json.load(f)
+
+        if config is None:
+            print(pier, "open failed")
+            return
+        configure_api(config)
+
+        union_json = None
+        with open("union_{}.json".format(self.namespace)) as f:
+            union_json = json.load(f)
+
+        with open(osp.expanduser("~/union.validators"), "rb") as f:
+            validators = f.read()
+
+        def start(i):
+            mount_union_pier = osp.join(config["base"], "mount_union_pier{}".format(i))
+            unionPierName = "union-{}".format(i)
+            files = {
+                "network.toml": osp.join(mount_union_pier, "network.toml"),
+                "union.validators": validators,
+            }
+            # one exec session: unpack the config, then start pier detached
+            print("\t", "upload {} and start pier in {}".format(", ".join(files), unionPierName))
+            upload_files(self.namespace, unionPierName, files, "/root/.pier",
+                         then="(pier start > log.txt 2>&1 < /dev/null &)")
+
+        with ThreadPoolExecutor(max_workers=max(len(union_json), 1)) as pool:
+            for future in [pool.submit(start, i) for i in range(len(union_json))]:
+                future.result()
+
+    def union_pier_register(self, configPath):
+        config = None
+        with open(configPath) as f:
+            config = json.load(f)
+        if config is None:
+            print(configPath, "open failed")
+            return
+
+        union_json = None
+        with open("union_{}.json".format(self.namespace)) as f:
+            union_json = json.load(f)
+        if union_json is None:
+            print("union_{}.json".format(self.namespace), "open failed")
+            return        
+
+        plan = load_plan(self.namespace, config)
+        if plan:
+            for podName, cmd in render(plan['commands']['union_register'], late_values(self.namespace)):
+                print("\t", self.exec_cmd(podName, cmd))
+            return
+
+        for i, (unionName, item) in enumerate(union_json.items()):
+            pierId = self.pier_address(unionName)
+
+            for podName, cmd in self.union_register_commands(union_json, i, pierId):
+                print("\t", self.exec_cmd(podName, cmd))
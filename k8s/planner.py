@@ -0,0 +1,229 @@
+import os
+import re
+import json
+import hashlib
+import yaml
+import shutil
+import logging
+import os.path as osp
+
+logger = logging.getLogger()
+
+# late-bound values (union pier ips, contract addresses) are written as {{key}}
+PLACEHOLDER = re.compile(r'\{\{([\w.-]+)\}\}')
+
+# bumped whenever the layout of plan.json or its manifests changes
+# 2: bitxhub and geth as StatefulSets
+# 3: digest of the config it was made from
+# 4: per-pod volumes of the bitxhub and geth StatefulSets
+PLAN_FORMAT = 4
+# config.json sections that only tune the tool, not what gets deployed
+RUNTIME_KEYS = ('api', 'load', 'monitor', 'pier_workers')
+
+
+def placeholder(key):
+    return '{{' + key + '}}'
+
+
+def plan_dir(namespace):
+    return 'plan_{}'.format(namespace)
+
+
+def render(value, values):
+    """
+    Fill every placeholder in a str (or the strs nested in a list/dict).
+    Raises KeyError for a placeholder that has no value yet.
+    """
+    if isinstance(value, str):
+        def sub(match):
+            key = match.group(1)
+            if key not in values:
+                raise KeyError('no value for placeholder {}'.format(key))
+            return str(values[key])
+        return PLACEHOLDER.sub(sub, value)
+    if isinstance(value, (list, tuple)):
+        return [render(v, values) for v in value]
+    if isinstance(value, dict):
+        return {k: render(v, values) for k, v in value.items()}
+    return value
+
+
+def render_file(src, dst, values):
+    with open(src) as f:
+        text = f.read()
+    with open(dst, 'w') as f:
+        f.write(render(text, values))
+
+
+def render_repo(src, dst, values):
+    """
+    Copy a planned pier repo to dst and fill the placeholders of its tomls.
+    """
+    if osp.exists(dst):
+        shutil.rmtree(dst)
+    shutil.copytree(src, dst, symlinks=True)
+    for root, _, files in os.walk(dst):
+        for name in files:
+            if name.endswith('.toml'):
+                render_file(osp.join(root, name), osp.join(root, name), values)
+
+
+def late_values(namespace):
+    """
+    Placeholder values known so far, from the deploy/union state files.
+    """
+    values = {}
+    if osp.exists("deploy_{}.json".format(namespace)):
+        with open("deploy_{}.json".format(namespace)) as f:
+            for item in json.load(f).values():
+                values['{}.broker'.format(item['id'])] = item['broker']
+                values['{}.transfer'.format(item['id'])] = item['transfer']
+    if osp.exists("union_{}.json".format(namespace)):
+        with open("union_{}.json".format(namespace)) as f:
+            for unionName, item in json.load(f).items():
+                if 'union_pier_ip' in item:
+                    values['{}.ip'.format(unionName)] = item['union_pier_ip']
+    return values
+
+
+def config_digest(config):
+    """
+    sha256 of the parts of config.json that shape the network.
+    """
+    shaping = {k: v for k, v in config.items() if k not in RUNTIME_KEYS}
+    return hashlib.sha256(json.dumps(shaping, sort_keys=True).encode()).hexdigest()
+
+
+def load_plan(namespace, config, staged=None):
+    """
+    The plan written by --plan, or None if there is none, it was made from
+    another config (graph, profiles, ...) or for other binaries than the
+    ones staged now.
+    """
+    path = osp.join(plan_dir(namespace), 'plan.json')
+    if not osp.exists(path):
+        return None
+    with open(path) as f:
+        plan = json.load(f)
+    if plan.get('format', 1) != PLAN_FORMAT:
+        logger.warning(f'{path} was made by an older version of this tool, ignoring it, re-run --plan')
+        return None
+    if plan['config'] != config_digest(config):
+        logger.warning(f'{path} was made from another config.json, ignoring it, re-run --plan')
+        return None
+    if staged is not None and plan['binaries'] != staged:
+        logger.warning(f'{path} was made for other pier/bitxhub builds, ignoring it, re-run --plan')
+        return None
+    return plan
+
+
+def plan_manifest(plan, name):
+    with open(osp.join(plan_dir(plan['namespace']), 'manifests', '{}.yaml'.format(name))) as f:
+        return yaml.safe_load(f)
+
+
+def plan_repo(plan, name):
+    return osp.join(plan_dir(plan['namespace']), 'repos', name)
+
+
+def build_plan(network, config, binaries):
+    """
+    Expand config.json into every artifact of the network without touching
+    the cluster: manifests, relay and union pier repos, network.toml and
+    registration commands, with placeholders for union pier ips and contract
+    addresses. Relay chains and geths are addressed by their StatefulSet DNS
+    names, which are known up front. `binaries` are the bin-cache paths of the configured builds.
+    """
+    namespace = network.namespace
+    out = plan_dir(namespace)
+    if osp.exists(out):
+        shutil.rmtree(out)
+    os.makedirs(osp.join(out, 'manifests'))
+    os.makedirs(osp.join(out, 'repos'))
+
+    graph = config['graph']
+    manifests = {}
+    plan = {
+        'format': PLAN_FORMAT,
+        'namespace': namespace,
+        'binaries': binaries,
+        'config': config_digest(config),
+        'geth': [],
+        'bitxhub': [],
+        'piers': {},
+        'unions': {},
+        'commands': {'register': [], 'union_register': []},
+    }
+
+    def pier_address(repo):
+        cmd = "{} key show --path {} | grep address".format(config['bitxhub'], osp.join(repo, 'key.json'))
+        return os.popen(cmd).read().split()[-1]
+
+    geth = network.geth_bodies(config)
+    bitxhub = network.bitxhub_bodies(config, binaries)
+    manifests.update(geth)
+    manifests.update(bitxhub)
+    plan['geth'] = list(geth)
+    plan['bitxhub'] = list(bitxhub)
+    appchainId = 0
+    for i, chains in enumerate(network.geth_layout(config)):
+        bitxhubName = 'bitxhub-{}'.format(i)
+        for j, (_, ethName) in enumerate(chains):
+            pierName = 'pier-{}-{}'.format(i, j)
+            appchain = 'ethappchain{}'.format(appchainId)
+            mount_pier = osp.join(config['base'], 'mount_pier{}{}'.format(i, j))
+            repo = osp.join(out, 'repos', osp.basename(mount_pier))
+            network.init_pier_repo(config, repo, network.bitxhub_host(i), network.geth_host(ethName),
+                                   appchain, placeholder('{}.broker'.format(appchain)))
+            manifests[pierName] = network.pier_pod_body(config, i, j, mount_pier, binaries)
+            item = {
+                "bitxhubName": bitxhubName,
+                "appchain_id": appchain,
+                "appchain_name": "eth{}{}".format(i, j),
+                "appchain_type": "ETH",
+                "appchain_geth": ethName,
+            }
+            plan['piers'][pierName] = item
+            plan['commands']['register'] += network.register_commands(
+                pierName, item, pier_address(repo),
+                placeholder('{}.broker'.format(appchain)), placeholder('{}.transfer'.format(appchain)))
+            appchainId += 1
+
+    for i in range(len(graph)):
+        bitxhubName = 'bitxhub-{}'.format(i)
+        unionName = 'union-{}'.format(i)
+        mount_union_pier = osp.join(config['base'], 'mount_union_pier{}'.format(i))
+        repo = osp.join(out, 'repos', osp.basename(mount_union_pier))
+        p2p_id = network.init_union_repo(config, i, repo, network.bitxhub_host(i))
+        manifests[unionName] = network.union_pod_body(config, i, mount_union_pier, binaries)
+        plan['unions'][unionName] = {
+            "bitxhubName": bitxhubName,
+            "bitxhubHost": network.bitxhub_host(i),
+            "bitxhubId": network.bitxhub_id(i),
+            "union_pier_port": "4343",
+            "union_pier_p2p_id": p2p_id,
+            "union_pier_ip": placeholder('{}.ip'.format(unionName)),
+            "pier_address": pier_address(repo),
+        }
+    network.write_union_network(plan['unions'], lambda i: plan_repo(plan, 'mount_union_pier{}'.format(i)))
+    for i, (unionName, item) in enumerate(plan['unions'].items()):
+        plan['commands']['union_register'] += network.union_register_commands(plan['unions'], i, item['pier_address'])
+
+    for name, body in manifests.items():
+        with open(osp.join(out, 'manifests', '{}.yaml'.format(name)), 'w') as f:
+            yaml.safe_dump(body, f, default_flow_style=False)
+
+    # everything the live run still has to fill in
+    keys = set(PLACEHOLDER.findall(json.dumps(plan)))
+    for root, _, files in os.walk(out):
+        for name in files:
+            if name.endswith(('.toml', '.yaml')):
+                with open(osp.join(root, name)) as f:
+                    keys.update(PLACEHOLDER.findall(f.read()))
+    plan['placeholders'] = sorted(keys)
+
+    json.dump(plan, open(osp.join(out, 'plan.json'), 'w'), indent=4)
+    logger.info(f'Planned {len(manifests)} manifests, {len(plan["piers"])} relay and {len(plan["unions"])} union '
+                f'pier repos, {sum(len(c) for c in plan["commands"].values())} registration commands, '
+                f'{len(keys)} placeholders into {out}/')
+    return plan
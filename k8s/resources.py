@@ -0,0 +1,147 @@
+import re
+import logging
+
+from kube import core_api
+
+logger = logging.getLogger()
+
+# Per role requests, `scale` is added once per unit of load the role serves
+# (appchains for bitxhub, peer relay chains for a union pier) and `burst`
+# is the limit/request ratio used for Burstable pods.
+PROFILES = {
+    'small': {
+        'geth': {'cpu': '250m', 'memory': '512Mi'},
+        'bitxhub': {'cpu': '500m', 'memory': '1Gi', 'scale': {'cpu': '100m', 'memory': '128Mi'}},
+        'pier': {'cpu': '100m', 'memory': '128Mi'},
+        'union': {'cpu': '100m', 'memory': '128Mi', 'scale': {'cpu': '50m', 'memory': '64Mi'}},
+        'burst': 2,
+    },
+    'medium': {
+        'geth': {'cpu': '1', 'memory': '2Gi'},
+        'bitxhub': {'cpu': '2', 'memory': '4Gi', 'scale': {'cpu': '250m', 'memory': '256Mi'}},
+        'pier': {'cpu': '250m', 'memory': '256Mi'},
+        'union': {'cpu': '250m', 'memory': '256Mi', 'scale': {'cpu': '100m', 'memory': '128Mi'}},
+        'burst': 2,
+    },
+    'large': {
+        'geth': {'cpu': '2', 'memory': '4Gi'},
+        'bitxhub': {'cpu': '4', 'memory': '8Gi', 'scale': {'cpu': '500m', 'memory': '512Mi'}},
+        'pier': {'cpu': '500m', 'memory': '512Mi'},
+        'union': {'cpu': '500m', 'memory': '512Mi', 'scale': {'cpu': '250m', 'memory': '256Mi'}},
+        'burst': 1.5,
+    },
+}
+
+# consensus and block production must never be throttled, piers may burst
+DEFAULT_QOS = {'geth': 'Guaranteed', 'bitxhub': 'Guaranteed', 'pier': 'Burstable', 'union': 'Burstable'}
+
+_MEMORY_UNITS = {'': 1, 'k': 10 ** 3, 'M': 10 ** 6, 'G': 10 ** 9, 'T': 10 ** 12,
+                 'Ki': 2 ** 10, 'Mi': 2 ** 20, 'Gi': 2 ** 30, 'Ti': 2 ** 40}
+
+
+def parse_cpu(value):
+    """ cpu quantity -> millicores """
+    value = str(value)
+    if value.endswith('m'):
+        return int(value[:-1])
+    return int(float(value) * 1000)
+
+
+def parse_memory(value):
+    """ memory quantity -> bytes """
+    number, unit = re.match(r'^([0-9.]+)([a-zA-Z]*)$', str(value)).groups()
+    return int(float(number) * _MEMORY_UNITS[unit])
+
+
+def format_resources(cpu, memory):
+    return {'cpu': '{}m'.format(int(cpu)), 'memory': '{}Mi'.format(int(memory) // 2 ** 20)}
+
+
+def role_resources(config, role, served=0):
+    """
+    Container `resources` for a role from the `resources` section of config.json.
+
+    Returns None when no profile is configured, which keeps the manifest's
+    own (empty) resources and so BestEffort pods.
+    """
+    section = config.get('resources')
+    if not section:
+        return None
+
+    # "profile": "custom" takes every role from `custom`, otherwise `custom`
+    # only overrides single roles of the chosen profile
+    profile = dict(PROFILES.get(section.get('profile', 'medium'), {}))
+    profile.update(section.get('custom', {}))
+    spec = profile[role]
+    qos = section.get('qos', {}).get(role, DEFAULT_QOS[role])
+
+    scale = spec.get('scale', {})
+    cpu = parse_cpu(spec['cpu']) + served * parse_cpu(scale.get('cpu', 0))
+    memory = parse_memory(spec['memory']) + served * parse_memory(scale.get('memory', 0))
+
+    if qos == 'BestEffort':
+        return {}
+    requests = format_resources(cpu, memory)
+    if qos == 'Guaranteed':
+        return {'requests': requests, 'limits': dict(requests)}
+    burst = profile.get('burst', 2)
+    return {'requests': requests, 'limits': format_resources(cpu * burst, memory * burst)}
+
+
+def apply_resources(container, resources):
+    if resources is not None:
+        container['resources'] = resources
+
+
+def check_capacity(demands, replacing=None):
+    """
+    Check the schedulable nodes can hold every pod in `demands`, a list of
+    (pod name, resources) as returned by role_resources.
+
+    Free capacity is node allocatable minus the requests of pods already
+    running there, except those of the namespace `replacing` which is about
+    to be cleared. Pods are placed first-fit-decreasing, so a passing check
+    also means no single pod is larger than every node.
+    Returns a list of problems, empty if everything fits.
+    """
+    api_instance = core_api()
+    free = {}
+    for node in api_instance.list_node().items:
+        if node.spec.unschedulable:
+            continue
+        ready = [c for c in node.status.conditions or [] if c.type == 'Ready' and c.status == 'True']
+        if not ready:
+            continue
+        alloc = node.status.allocatable
+        free[node.metadata.name] = [parse_cpu(alloc['cpu']), parse_memory(alloc['memory'])]
+
+    for pod in api_instance.list_pod_for_all_namespaces().items:
+        if pod.spec.node_name not in free or pod.status.phase in ('Succeeded', 'Failed'):
+            continue
+        if pod.metadata.namespace == replacing:
+            continue
+        for container in pod.spec.containers:
+            requests = (container.resources and container.resources.requests) or {}
+            free[pod.spec.node_name][0] -= parse_cpu(requests.get('cpu', 0))
+            free[pod.spec.node_name][1] -= parse_memory(requests.get('memory', 0))
+
+    wanted = [(name, parse_cpu(r['requests']['cpu']), parse_memory(r['requests']['memory']))
+              for name, r in demands if r and 'requests' in r]
+    wanted.sort(key=lambda w: (w[1], w[2]), reverse=True)
+
+    problems = []
+    for name, cpu, memory in wanted:
+        for node, room in free.items():
+            if room[0] >= cpu and room[1] >= memory:
+                room[0] -= cpu
+                room[1] -= memory
+                break
+        else:
+            problems.append('{} needs cpu {}m memory {}Mi but no node has room left'.format(
+                name, cpu, memory // 2 ** 20))
+
+    total_cpu = sum(w[1] for w in wanted)
+    total_memory = sum(w[2] for w in wanted)
+    logger.info(f'Pre-flight: {len(wanted)} pods request cpu {total_cpu}m memory {total_memory // 2 ** 20}Mi '
+                f'on {len(free)} nodes')
+    return problems
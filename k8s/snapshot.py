@@ -0,0 +1,278 @@
+import os
+import re
+import json
+import time
+import shutil
+import tarfile
+import logging
+import os.path as osp
+from concurrent.futures import ThreadPoolExecutor
+
+from kube import (core_api, apps_api, configure_api, create_or_get, exec_script, download_archive,
+                  upload_archive, export_body, pod_ips)
+from network import LOCAL_NODE_IP
+
+logger = logging.getLogger()
+
+# state files of a network, <prefix>_<name>.json
+STATE_FILES = ('graph', 'deploy', 'pier', 'union')
+# node repos (config, keys, ledger) of bitxhub-in-one
+BITXHUB_BUILD = '/root/bitxhub/scripts/build'
+BITXHUB_NODES = 4
+PIER_REPO = '/root/.pier'
+# emptyDir of a restored StatefulSet pod, k8s/statefulset-bitxhub.yaml looks for RESTORE_DIR/ready
+RESTORE_DIR = '/root/restore'
+
+
+def snapshot_dir(namespace, config):
+    return config.get('snapshot', {}).get('dir', 'snapshot_{}'.format(namespace))
+
+
+def data_dir(body):
+    """
+    Directory the pods of an exported StatefulSet keep their data in, None
+    if they have none worth keeping.
+    """
+    name = body['metadata']['name']
+    if name == 'bitxhub':
+        return BITXHUB_BUILD
+    if name.startswith('geth'):
+        container = body['spec']['template']['spec']['containers'][0]
+        command = ' '.join(container.get('command', []) + container.get('args', []))
+        match = re.search(r'--datadir[= ](\S+)', command)
+        return match.group(1) if match else None
+    return None
+
+
+def gated(body, data):
+    """
+    `body` with its container held until the pod's archive is unpacked to
+    RESTORE_DIR/data, which is copied to `data` before the original command
+    runs. The emptyDir keeps the archive across container restarts, the
+    copy is only made once so a restarted container keeps its newer data.
+    """
+    spec = body['spec']['template']['spec']
+    if any(volume['name'] == 'restore' for volume in spec.get('volumes', [])):
+        # exported from a restored network, gated already
+        return body
+    spec.setdefault('volumes', []).append({'name': 'restore', 'emptyDir': {}})
+    container = spec['containers'][0]
+    container.setdefault('volumeMounts', []).append({'name': 'restore', 'mountPath': RESTORE_DIR})
+    script = ('until [ -f {0}/ready ]; do sleep 1; done && mkdir -p {1} && '
+              '{{ [ -f {1}/.restored ] || {{ cp -a {0}/data/. {1}/ && touch {1}/.restored; }}; }} && exec "$@"'
+              .format(RESTORE_DIR, data))
+    container['args'] = container.get('command', []) + container.get('args', [])
+    container['command'] = ['sh', '-c', script, 'restore']
+    return body
+
+
+def stop_bitxhub(namespace, pod):
+    # the ledger is only consistent on disk once the nodes stopped
+    script = ('pkill -INT -x bitxhub; '
+              'for i in $(seq 60); do pgrep -x bitxhub > /dev/null || exit 0; sleep 1; done; exit 1')
+    ok, _, err = exec_script(namespace, pod, script)
+    if not ok:
+        raise RuntimeError('bitxhub nodes of {} did not stop: {}'.format(pod, err.strip()))
+
+
+def start_bitxhub(namespace, pod):
+    # cluster.sh started node n in pane n-1 of tmux window 0, its shell is still there
+    script = '; '.join('tmux send-keys -t bitxhub:0.{} "bitxhub --repo={}/node{} start" C-m'.format(n - 1, BITXHUB_BUILD, n)
+                       for n in range(1, BITXHUB_NODES + 1))
+    ok, _, err = exec_script(namespace, pod, script)
+    if not ok:
+        raise RuntimeError('bitxhub nodes of {} did not start: {}'.format(pod, err.strip()))
+
+
+def stop_geth(namespace, pod, datadir):
+    # no block is sealed, and so nothing of the chain written, while the datadir is copied
+    ok, _, err = exec_script(namespace, pod, "geth attach --exec 'miner.stop()' {}/geth.ipc".format(datadir))
+    if not ok:
+        raise RuntimeError('geth of {} did not stop sealing: {}'.format(pod, err.strip()))
+
+
+def start_geth(namespace, pod, datadir):
+    ok, _, err = exec_script(namespace, pod, "geth attach --exec 'miner.start()' {}/geth.ipc".format(datadir))
+    if not ok:
+        raise RuntimeError('geth of {} did not resume sealing: {}'.format(pod, err.strip()))
+
+
+def take_snapshot(network, config_path):
+    """
+    Save a registered network into snapshot.dir of config.json: its state
+    files, the StatefulSet, Secret and headless Service bodies, and one
+    archive per pod of the bitxhub node repos, geth datadirs and pier repos.
+
+    Take it while no load runs. The bitxhub nodes of a pod are stopped and
+    geths stop sealing while their data is copied, so no block is written
+    mid-copy. --gcmode archive does not make a live copy consistent, it only
+    keeps the state of every block on disk instead of in memory.
+    """
+    with open(config_path) as f:
+        config = json.load(f)
+    configure_api(config)
+    namespace = network.namespace
+    out = snapshot_dir(namespace, config)
+    if osp.exists(out):
+        shutil.rmtree(out)
+    os.makedirs(osp.join(out, 'pods'))
+
+    for prefix in STATE_FILES:
+        name = '{}_{}.json'.format(prefix, namespace)
+        if osp.exists(name):
+            shutil.copy(name, osp.join(out, name))
+
+    # secrets and services first, the StatefulSets need them
+    bodies = [export_body(s, 'Secret', 'v1')
+              for s in core_api().list_namespaced_secret(namespace).items if s.type == 'Opaque']
+    bodies += [export_body(s, 'Service', 'v1')
+               for s in core_api().list_namespaced_service(namespace).items if s.spec.cluster_ip == 'None']
+    bodies += [export_body(s, 'StatefulSet', 'apps/v1')
+               for s in apps_api().list_namespaced_stateful_set(namespace).items]
+
+    # pod -> directory to archive
+    pods = {}
+    for body in bodies:
+        if body['kind'] == 'StatefulSet' and body['metadata']['name'].startswith('geth'):
+            container = body['spec']['template']['spec']['containers'][0]
+            if '--gcmode archive' not in ' '.join(container.get('command', []) + container.get('args', [])):
+                logger.warning(f'{body["metadata"]["name"]} runs without --gcmode archive, its geths may be '
+                               f'restored at an older state; set `snapshot` in config.json before --create')
+        if body['kind'] == 'StatefulSet' and data_dir(body):
+            for k in range(body['spec']['replicas']):
+                pods['{}-{}'.format(body['metadata']['name'], k)] = data_dir(body)
+    for pod in core_api().list_namespaced_pod(namespace).items:
+        if pod.metadata.name.startswith(('pier-', 'union-')):
+            pods[pod.metadata.name] = PIER_REPO
+
+    def save(pod, src):
+        path = osp.join(out, 'pods', '{}.tar.gz'.format(pod))
+        if src == PIER_REPO:
+            download_archive(namespace, pod, src, path)
+            return
+        bitxhub = src == BITXHUB_BUILD
+        if bitxhub:
+            stop_bitxhub(namespace, pod)
+        else:
+            stop_geth(namespace, pod, src)
+        try:
+            download_archive(namespace, pod, src, path, exclude=('geth.ipc',))
+        finally:
+            if bitxhub:
+                start_bitxhub(namespace, pod)
+            else:
+                start_geth(namespace, pod, src)
+
+    started = time.time()
+    workers = config.get('snapshot', {}).get('workers', 8)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pods)))) as pool:
+        futures = {pod: pool.submit(save, pod, src) for pod, src in pods.items()}
+        for pod, future in futures.items():
+            future.result()
+            logger.info(f'{pod}: {pods[pod]} saved')
+
+    meta = {'namespace': namespace, 'time': int(time.time()), 'bodies': bodies, 'pods': pods}
+    json.dump(meta, open(osp.join(out, 'snapshot.json'), 'w'), indent=4)
+    size = sum(osp.getsize(osp.join(out, 'pods', name)) for name in os.listdir(osp.join(out, 'pods')))
+    logger.info(f'Saved {len(pods)} pods ({size // 2 ** 20}MiB) of "{namespace}" to {out}/ '
+                f'in {time.time() - started:.1f}s')
+
+
+def restore_snapshot(network, config_path):
+    """
+    Recreate the namespace from a snapshot of take_snapshot(): StatefulSet
+    pods wait until their archive is unpacked, pier repos are unpacked and
+    copied to every node, then the pier pods are created and the union piers
+    started with their new pod ips. No contract is deployed and no vote cast.
+    """
+    with open(config_path) as f:
+        config = json.load(f)
+    configure_api(config)
+    namespace = network.namespace
+    src = snapshot_dir(namespace, config)
+    with open(osp.join(src, 'snapshot.json')) as f:
+        meta = json.load(f)
+    if not network.clear_namespace():
+        return
+
+    started = time.time()
+    # the snapshot may come from a network of another name
+    for prefix in STATE_FILES:
+        name = osp.join(src, '{}_{}.json'.format(prefix, meta['namespace']))
+        if osp.exists(name):
+            shutil.copy(name, '{}_{}.json'.format(prefix, namespace))
+
+    network.create_namespace()
+    network.create_service()
+    nodeIpList = network.get_node_ip_list()
+    staged = network.stage_binaries(config, nodeIpList)
+
+    bodies = {}
+    for body in meta['bodies']:
+        if body['kind'] == 'StatefulSet' and data_dir(body):
+            body = gated(body, data_dir(body))
+        bodies['{}/{}'.format(body['kind'], body['metadata']['name'])] = body
+    network.create_bodies(bodies)
+
+    archive = lambda pod: osp.join(src, 'pods', '{}.tar.gz'.format(pod))
+    stateful = [pod for pod, path in meta['pods'].items() if path != PIER_REPO]
+    piers = [pod for pod, path in meta['pods'].items() if path == PIER_REPO]
+
+    def seed(pod):
+        upload_archive(namespace, pod, archive(pod), RESTORE_DIR + '/data', then='touch {}/ready'.format(RESTORE_DIR))
+        logger.info(f'{pod}: restored')
+
+    def unpack_repo(pod):
+        # pier-<i>-<j> mounts <base>/mount_pier<i><j>, union-<i> <base>/mount_union_pier<i>
+        index = pod.split('-')[1:]
+        repo = osp.join(config['base'], ('mount_pier' if pod.startswith('pier-') else 'mount_union_pier') + ''.join(index))
+        if osp.exists(repo):
+            shutil.rmtree(repo)
+        os.makedirs(repo)
+        with tarfile.open(archive(pod)) as tar:
+            tar.extractall(repo)
+        for nodeIp in nodeIpList:
+            if nodeIp == LOCAL_NODE_IP:
+                continue
+            cmd = "sshpass -p {} scp -r {} {}@{}:{}".format(config["passwd"], repo, config["user"], nodeIp, config["base"])
+            if os.system(cmd) != 0:
+                raise RuntimeError("copy of {} to {} failed".format(repo, nodeIp))
+        return repo
+
+    workers = config.get('snapshot', {}).get('workers', 8)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        # pier repos are unpacked while the StatefulSet pods start
+        repos = {pod: pool.submit(unpack_repo, pod) for pod in piers}
+        pod_ips(namespace, stateful, wait=True)
+        for future in [pool.submit(seed, pod) for pod in stateful]:
+            future.result()
+        repos = {pod: future.result() for pod, future in repos.items()}
+
+    for pod, repo in repos.items():
+        index = [int(n) for n in pod.split('-')[1:]]
+        if pod.startswith('pier-'):
+            body = network.pier_pod_body(config, index[0], index[1], repo, staged)
+        else:
+            body = network.union_pod_body(config, index[0], repo, staged)
+        create_or_get(core_api(), 'pod', body, namespace)
+
+    unions = [pod for pod in repos if pod.startswith('union-')]
+    if unions:
+        ips = pod_ips(namespace, unions, wait=True)
+        with open('union_{}.json'.format(namespace)) as f:
+            union_json = json.load(f)
+        moved = {item['union_pier_ip']: ips[name] for name, item in union_json.items()}
+        for name, item in union_json.items():
+            item['union_pier_ip'] = ips[name]
+        json.dump(union_json, open('union_{}.json'.format(namespace), 'w'), indent=4)
+        # union piers find each other by /ip4 multiaddr, point them at the new pods
+        for name in unions:
+            path = osp.join(repos[name], 'network.toml')
+            with open(path) as f:
+                text = f.read()
+            text = re.sub(r'/ip4/([\d.]+)/', lambda m: '/ip4/{}/'.format(moved.get(m.group(1), m.group(1))), text)
+            with open(path, 'w') as f:
+                f.write(text)
+        network.create_deployment_union_start(config_path)
+
+    logger.info(f'Restored "{namespace}" from {src}/ in {time.time() - started:.1f}s')
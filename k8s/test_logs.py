@@ -0,0 +1,105 @@
+import os
+import csv
+import shutil
+import tempfile
+import unittest
+
+from logs import LatencyTracker, classify, ibtp_id, parse_time
+
+SRC = '0x3f9d18f75e16a3ea3af2f9f2e4f7bc1ba4cc8da2'
+DST = '0x9b2a1a0b2c8d0e5ac3c3c3b7ed28e0e42b4e39f1'
+
+# one interchain tx as the source pier, bitxhub and the destination pier log it
+TX_LINES = [
+    ('pier-1', 'time="2021-06-09T14:49:34.100+08:00" level=info msg="Receive interchain ibtp from appchain" '
+               'ibtp_id={}-{}-1 module=monitor'.format(SRC, DST)),
+    ('pier-1', 'time="2021-06-09T14:49:34.250+08:00" level=info msg="Submit ibtp to bitxhub" '
+               'id={}-{}-1 module=exchanger'.format(SRC, DST)),
+    ('bitxhub-0-node1', 'time="2021-06-09T14:49:34.900+08:00" level=info msg="Handle ibtp" '
+                        'from={} to={} index=1 module=executor'.format(SRC, DST)),
+    ('pier-2', 'time="2021-06-09T14:49:35.600+08:00" level=info msg="Confirm ibtp" '
+               'ibtp_id={}-{}-1 module=executor'.format(SRC, DST)),
+]
+BLOCK_LINE = ('time="2021-06-09T14:49:34.800+08:00" level=info msg="Block committed" '
+              'height=12 count=1 module=executor')
+
+
+class LatencyTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'latency.csv')
+        self.tracker = LatencyTracker(self.path)
+
+    def tearDown(self):
+        self.tracker.file.close()
+        shutil.rmtree(self.dir)
+
+    def feed(self, lines):
+        for source, line in lines:
+            event = classify(line)
+            if event is not None:
+                self.tracker.record(source, event, line, parse_time(line, None))
+
+    def rows(self):
+        self.tracker.file.flush()
+        with open(self.path, newline='') as f:
+            return list(csv.DictReader(f))
+
+    def test_extract(self):
+        self.assertEqual([classify(line) for _, line in TX_LINES],
+                         ['received', 'submitted', 'received', 'confirmed'])
+        self.assertEqual(classify(BLOCK_LINE), 'block')
+        self.assertIsNone(classify('time="2021-06-09T14:49:34.800+08:00" level=info msg="Sync appchain"'))
+        ids = {ibtp_id(line) for _, line in TX_LINES}
+        self.assertEqual(ids, {'{}-{}-1'.format(SRC, DST)})
+
+    def test_hops(self):
+        self.feed(TX_LINES + [('bitxhub-0-node1', BLOCK_LINE)])
+        hops = [(r['from'], r['to'], float(r['latency'])) for r in self.rows() if r['kind'] == 'hop']
+        self.assertEqual([(a, b) for a, b, _ in hops], [
+            ('pier-1:received', 'pier-1:submitted'),
+            ('pier-1:submitted', 'bitxhub-0:received'),
+            ('bitxhub-0:received', 'pier-2:confirmed'),
+        ])
+        for (_, _, got), want in zip(hops, (0.15, 0.65, 0.7)):
+            self.assertAlmostEqual(got, want, places=3)
+        blocks = [r for r in self.rows() if r['kind'] == 'block']
+        self.assertEqual(blocks[0]['id'], '12')
+
+    def test_index_keys_hops(self):
+        second = [(source, line.replace('-1 ', '-2 ').replace('index=1', 'index=2'))
+                  for source, line in TX_LINES[:2]]
+        # the two txs interleave, their hops must not mix
+        self.feed([TX_LINES[0], second[0], TX_LINES[1], second[1]])
+        ids = sorted(r['id'] for r in self.rows() if r['kind'] == 'hop')
+        self.assertEqual(ids, ['{}-{}-1'.format(SRC, DST), '{}-{}-2'.format(SRC, DST)])
+
+    def test_relay_nodes_are_one_hop(self):
+        # every node of the relay chain logs the ibtp, a little later each
+        nodes = [('bitxhub-0-node{}'.format(n), TX_LINES[2][1].replace('34.900', '34.9{}0'.format(n)))
+                 for n in range(1, 5)]
+        self.feed(TX_LINES[:2] + nodes + TX_LINES[3:])
+        hops = [(r['from'], r['to'], float(r['latency'])) for r in self.rows() if r['kind'] == 'hop']
+        self.assertEqual([(a, b) for a, b, _ in hops], [
+            ('pier-1:received', 'pier-1:submitted'),
+            ('pier-1:submitted', 'bitxhub-0:received'),
+            ('bitxhub-0:received', 'pier-2:confirmed'),
+        ])
+        # measured from the first node to log it
+        self.assertAlmostEqual(hops[1][2], 0.66, places=3)
+
+    def test_confirmed_forgets_ibtp(self):
+        self.feed(TX_LINES)
+        self.assertEqual(self.tracker.last, {})
+
+    def test_negative_delta_dropped(self):
+        late = ('pier-2', TX_LINES[3][1].replace('14:49:35.600', '14:49:33.000'))
+        self.feed(TX_LINES[:3] + [late])
+        latencies = [float(r['latency']) for r in self.rows() if r['kind'] == 'hop']
+        self.assertEqual(len(latencies), 2)
+        self.assertTrue(all(latency >= 0 for latency in latencies))
+        self.assertEqual(len(self.tracker.hops), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()